@@ -0,0 +1,8 @@
+import os
+from tempfile import TemporaryDirectory
+
+# Benchmarks run the real handlers, which write to the bot's SQLite stores.
+# They get a throwaway data directory, set before scoredb_bot is imported, so
+# fake file IDs and payloads never reach the bot's own databases.
+_data_dir = TemporaryDirectory(prefix='scoredb-bench-')
+os.environ['DATA_DIR'] = _data_dir.name
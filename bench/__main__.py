@@ -0,0 +1,50 @@
+import json
+import os
+import sys
+from argparse import ArgumentParser
+from platform import python_version
+from time import time
+
+os.environ.setdefault('TELEGRAM_TOKEN', '4242:fake-token-for-benchmarks')
+os.environ.setdefault('INLINE_DEBOUNCE', '0')
+os.environ.setdefault('PREFETCH_ENABLED', 'false')
+os.environ.setdefault('SCOREDB_TOKEN_RATE', '0')
+
+from .handlers import run_handlers  # noqa: E402
+from .micro import run_micro  # noqa: E402
+
+
+def main():
+    parser = ArgumentParser(description='Run the offline benchmark suite against fake Telegram and ScoreDB backends')
+    parser.add_argument('--iterations', type=int, default=200, help='calls per handler')
+    parser.add_argument('--micro-iterations', type=int, default=5000, help='calls per micro benchmark')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent handler calls')
+    parser.add_argument('--latency', type=float, default=0.02, help='fake ScoreDB latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of fake ScoreDB calls failing')
+    parser.add_argument('--send-latency', type=float, default=0.0, help='fake Bot API latency in seconds')
+    parser.add_argument('--cold', action='store_true', help='clear the fetcher caches before every call')
+    parser.add_argument('--only', nargs='*', help='only run the named handlers or micro benchmarks')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    results = {
+        'meta': {
+            'timestamp': time(),
+            'python': python_version(),
+            'args': vars(args),
+        },
+        'handlers': run_handlers(args.iterations, args.concurrency, args.latency, args.error_rate,
+                                 args.send_latency, args.cold, args.only),
+        'micro': run_micro(args.micro_iterations, args.only),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
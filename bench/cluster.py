@@ -0,0 +1,88 @@
+import json
+import multiprocessing
+import os
+import sys
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from queue import Queue
+from threading import Thread
+from time import perf_counter
+
+os.environ.setdefault('TELEGRAM_TOKEN', '4242:fake-token-for-benchmarks')
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Dispatcher, Filters, MessageHandler  # noqa: E402
+
+from scoredb_bot.cluster import Cluster, feed  # noqa: E402
+from .fakes import FakeBot, message_update  # noqa: E402
+
+ROSTER = [{'id': f'G1901{i:02d}', 'name': '赵钱', 'gender': '男'} for i in range(40)]
+
+
+# Stands in for the CPU-bound part of a handler: rendering and (de)serializing a roster.
+def busy(work: int):
+    for _ in range(work):
+        json.loads(json.dumps(ROSTER))
+
+
+def bench_worker(index: int, queue, results, work: int):
+    bot = FakeBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=1, use_context=True)
+
+    def handle(update: Update, _context):
+        busy(work)
+        results.put((update.effective_user.id, update.update_id, index))
+
+    dispatcher.add_handler(MessageHandler(Filters.all, handle))
+    Thread(target=dispatcher.start, name='dispatcher', daemon=True).start()
+    results.put(None)
+    feed(queue, bot, dispatcher.update_queue)
+    dispatcher.stop()
+
+
+def run_cluster(processes: int, users: int, updates: int, work: int) -> dict:
+    results = multiprocessing.get_context('spawn').Queue()
+    cluster = Cluster(processes, bench_worker, args=(results, work))
+    cluster.start()
+    for _ in range(processes):
+        results.get()
+
+    # A fake update source: messages from `users` users, interleaved.
+    started = perf_counter()
+    for i in range(updates):
+        cluster.router.put(Update.de_json(message_update(1000 + i % users, 'G1901'), None))
+    received = [results.get() for _ in range(updates)]
+    elapsed = perf_counter() - started
+    cluster.stop()
+
+    handled = defaultdict(list)
+    workers = defaultdict(set)
+    for user_id, update_id, index in received:
+        handled[user_id].append(update_id)
+        workers[user_id].add(index)
+    return {
+        'processes': processes,
+        'updates': updates,
+        'elapsed': elapsed,
+        'throughput': updates / elapsed if elapsed else 0.0,
+        'in_order_per_user': all(ids == sorted(ids) for ids in handled.values()),
+        'one_worker_per_user': all(len(indexes) == 1 for indexes in workers.values()),
+        'updates_per_worker': dict(Counter(index for _, _, index in received)),
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Route fake updates through the multi-process cluster mode')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--work', type=int, default=20, help='roster (de)serializations per update')
+    args = parser.parse_args()
+
+    results = [run_cluster(processes, args.users, args.updates, args.work) for processes in args.processes]
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+import json
+from argparse import ArgumentParser
+
+
+def main():
+    parser = ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f'{"benchmark":<36} {"metric":<10} {"baseline":>12} {"candidate":>12} {"change":>8}')
+    for section in ('handlers', 'micro'):
+        for name, before in baseline.get(section, {}).items():
+            after = candidate.get(section, {}).get(name)
+            if after is None:
+                continue
+            for metric in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms'):
+                old, new = before[metric], after[metric]
+                change = f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+                print(f'{section + "." + name:<36} {metric:<10} {old:>12.3f} {new:>12.3f} {change:>8}')
+
+
+if __name__ == '__main__':
+    main()
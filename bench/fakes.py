@@ -0,0 +1,225 @@
+import random
+from itertools import count
+from threading import Lock
+from time import sleep
+from typing import Dict, List, Optional
+
+from requests import HTTPError, Response
+from scoredb.client import Pagination
+from telegram import Bot
+
+BOT_USER = {'id': 4242, 'is_bot': True, 'first_name': 'StudentDB', 'username': 'StudentDB_bot'}
+
+GENDERS = ('男', '女')
+NAMES = '赵钱孙李周吴郑王冯陈褚卫蒋沈韩杨朱秦尤许'
+
+
+class StudentSummary:
+    def __init__(self, id: str, name: str, gender: str):
+        self.id = id
+        self.name = name
+        self.gender = gender
+
+
+class Student(StudentSummary):
+    def __init__(self, id: str, name: str, gender: str, classId: str,
+                 birthday: Optional[str], eduid: Optional[str]):
+        super().__init__(id, name, gender)
+        self.classId = classId
+        self.birthday = birthday
+        self.eduid = eduid
+
+
+class Class:
+    def __init__(self, id: str, students: List[StudentSummary]):
+        self.id = id
+        self.students = students
+        self.studentsCount = len(students)
+
+
+class Grade:
+    def __init__(self, id: str, classes: List[Class]):
+        self.id = id
+        self.classes = classes
+        self.classesCount = len(classes)
+        self.studentsCount = sum(c.studentsCount for c in classes)
+
+
+class FakeUser:
+    def check_access(self, _scopes) -> bool:
+        return True
+
+
+def build_school(grades: int = 3, classes: int = 10, students: int = 40) -> Dict[str, dict]:
+    school = {'grades': {}, 'classes': {}, 'students': {}}
+    for g in range(grades):
+        grade_id = f'G{19 + g}'
+        grade_classes = []
+        for c in range(1, classes + 1):
+            class_id = f'{grade_id}{c:02d}'
+            roster = []
+            for s in range(1, students + 1):
+                student_id = f'{class_id}{s:02d}'
+                name = NAMES[(g + c + s) % len(NAMES)] + NAMES[s % len(NAMES)]
+                student = Student(student_id, name, GENDERS[s % 2], class_id,
+                                  f'20{g:02d}-0{c % 9 + 1}-1{s % 9}', f'E{student_id}')
+                school['students'][student_id] = student
+                roster.append(StudentSummary(student_id, name, student.gender))
+            class_ = Class(class_id, roster)
+            school['classes'][class_id] = class_
+            grade_classes.append(class_)
+        school['grades'][grade_id] = Grade(grade_id, grade_classes)
+    return school
+
+
+def http_error(status: int) -> HTTPError:
+    response = Response()
+    response.status_code = status
+    return HTTPError(f'{status} Error', response=response)
+
+
+# Stands in for ScoreDB at the scoredb.Client boundary, with configurable
+# latency and a random rate of 500 responses.
+class FakeStudentDB:
+    def __init__(self, school: dict, latency: float, error_rate: float, seed: int = 0):
+        self.school = school
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.calls = 0
+
+    def _call(self):
+        with self.lock:
+            self.calls += 1
+            jitter = self.random.uniform(0.5, 1.5)
+            failed = self.random.random() < self.error_rate
+        if self.latency > 0:
+            sleep(self.latency * jitter)
+        if failed:
+            raise http_error(500)
+
+    def _get(self, kind: str, key: str):
+        self._call()
+        value = self.school[kind].get(key)
+        if value is None:
+            raise http_error(404)
+        return value
+
+    def get_grade_details(self, grade_id: str):
+        return self._get('grades', grade_id)
+
+    def get_class_details(self, class_id: str):
+        return self._get('classes', class_id)
+
+    def get_student_details(self, student_id: str):
+        return self._get('students', student_id)
+
+    def get_student_photos(self, student_id: str) -> List[str]:
+        self._call()
+        if student_id not in self.school['students']:
+            return []
+        return [f'https://scoredb.invalid/photos/{student_id}/{i}.jpg' for i in range(2)]
+
+    def search_student(self, query: str, page: int = 1, page_size: int = 9):
+        self._call()
+        found = [StudentSummary(s.id, s.name, s.gender) for s in self.school['students'].values()
+                 if query in s.id or query in s.name]
+        pages = (len(found) + page_size - 1) // page_size
+        return Pagination(found[(page - 1) * page_size:page * page_size], page, pages)
+
+
+class FakeClient:
+    def __init__(self, studentdb: FakeStudentDB):
+        self.studentdb = studentdb
+
+
+class FakeBot(Bot):
+    def __init__(self, latency: float = 0):
+        super().__init__('4242:fake-token-for-benchmarks')
+        self.latency = latency
+        self.message_ids = count(1)
+        self.calls = 0
+
+    def _message_json(self, data: dict, **extra) -> dict:
+        return {
+            'message_id': data.get('message_id') or next(self.message_ids),
+            'date': 0,
+            'chat': {'id': data.get('chat_id', 0), 'type': 'private'},
+            'from': BOT_USER,
+            'text': data.get('text', ''),
+            **extra,
+        }
+
+    def _post(self, endpoint: str, data: dict = None, *args, **kwargs):
+        self.calls += 1
+        data = data or {}
+        if self.latency > 0 and endpoint != 'getMe':
+            sleep(self.latency)
+        if endpoint == 'getMe':
+            return BOT_USER
+        if endpoint in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            return self._message_json(data)
+        if endpoint in ('sendPhoto', 'sendDocument'):
+            return self._message_json(data, photo=[self._photo_json()])
+        if endpoint == 'sendMediaGroup':
+            return [self._message_json(data, photo=[self._photo_json()]) for _ in data.get('media', [])]
+        return True
+
+    def _photo_json(self) -> dict:
+        file_id = f'fake-file-{next(self.message_ids)}'
+        return {'file_id': file_id, 'file_unique_id': file_id, 'width': 1, 'height': 1}
+
+
+_update_ids = count(1)
+
+
+def user_json(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+
+def message_update(user_id: int, text: str) -> dict:
+    update_id = next(_update_ids)
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': user_json(user_id),
+            'text': text,
+        },
+    }
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    update_id = next(_update_ids)
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user_json(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': 0,
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': '',
+            },
+        },
+    }
+
+
+def inline_update(user_id: int, query: str, offset: str = '') -> dict:
+    update_id = next(_update_ids)
+    return {
+        'update_id': update_id,
+        'inline_query': {
+            'id': str(update_id),
+            'from': user_json(user_id),
+            'query': query,
+            'offset': offset,
+        },
+    }
@@ -0,0 +1,116 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+from queue import Queue
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, List
+
+from telegram import Update
+from telegram.ext import CallbackContext, Dispatcher
+
+from scoredb_bot import fetcher
+from scoredb_bot.commands._callback import callback
+from scoredb_bot.commands._inline import inline_search
+from scoredb_bot.commands.photos import all_photos_callback
+from scoredb_bot.commands.search import search
+from scoredb_bot.ttl_cache import caches
+from scoredb_bot.utils import encode_data
+from .fakes import FakeBot, FakeClient, FakeStudentDB, FakeUser, build_school, \
+    callback_update, inline_update, message_update
+from .stats import summarize
+
+USERS = range(1000, 1020)
+
+
+class HandlerBench:
+    def __init__(self, latency: float, error_rate: float, send_latency: float, cold: bool):
+        self.school = build_school()
+        self.studentdb = FakeStudentDB(self.school, latency, error_rate)
+        self.bot = FakeBot(send_latency)
+        self.dispatcher = Dispatcher(self.bot, Queue(), workers=1, use_context=True)
+        self.cold = cold
+        client = FakeClient(self.studentdb)
+        fetcher.get_client = lambda token: client
+        for user_id in USERS:
+            self.dispatcher.user_data[user_id].update({'token': f'bench-{user_id}', 'user': FakeUser()})
+
+    def context(self, update: Update) -> CallbackContext:
+        return CallbackContext.from_update(update, self.dispatcher)
+
+    def workloads(self) -> Dict[str, Callable[[int, int], Callable[[], None]]]:
+        grades = list(self.school['grades'])
+        classes = list(self.school['classes'])
+        students = list(self.school['students'])
+        names = sorted({s.name for s in self.school['students'].values()})
+        queries = cycle(grades + classes[:10] + students[:20] + names[:10])
+        callbacks = cycle([
+            encode_data('class', class_id=classes[0], page=2),
+            encode_data('student', student_id=students[3],
+                        from_page={'event_type': 'class', 'class_id': classes[0], 'page': 1}),
+            encode_data('search', query=names[0], page=1),
+        ])
+        prefixes = cycle([names[0][:1], names[0], students[0][:5], students[0]])
+
+        def search_call(i: int, user_id: int):
+            update = Update.de_json(message_update(user_id, next(queries)), self.bot)
+            return lambda: search(update, self.context(update), update.effective_message.text)
+
+        def callback_call(i: int, user_id: int):
+            update = Update.de_json(callback_update(user_id, next(callbacks)), self.bot)
+            return lambda: callback(update, self.context(update))
+
+        def inline_call(i: int, user_id: int):
+            update = Update.de_json(inline_update(user_id, next(prefixes)), self.bot)
+            return lambda: inline_search(update, self.context(update))
+
+        def all_photos_call(i: int, user_id: int):
+            class_ = self.school['classes'][classes[i % len(classes)]]
+            page = [s.id for s in class_.students[:9]]
+            update = Update.de_json(callback_update(user_id, encode_data('all_photos', students=page)), self.bot)
+            return lambda: all_photos_callback(update, self.context(update), page)
+
+        return {
+            'search': search_call,
+            'callback': callback_call,
+            'inline_search': inline_call,
+            'all_photos_callback': all_photos_call,
+        }
+
+    def run(self, make_call: Callable, iterations: int, concurrency: int) -> dict:
+        samples: List[float] = []
+        errors = 0
+        lock = Lock()
+        calls = [make_call(i, USERS[i % len(USERS)]) for i in range(iterations)]
+        upstream_before = self.studentdb.calls
+
+        def timed(call: Callable):
+            nonlocal errors
+            if self.cold:
+                for cache in caches.values():
+                    cache.clear()
+            started = perf_counter()
+            try:
+                call()
+            except Exception:
+                with lock:
+                    errors += 1
+            with lock:
+                samples.append(perf_counter() - started)
+
+        started = perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(timed, calls))
+        result = summarize(samples, perf_counter() - started)
+        result['errors'] = errors
+        result['upstream_calls'] = self.studentdb.calls - upstream_before
+        return result
+
+
+def run_handlers(iterations: int, concurrency: int, latency: float, error_rate: float,
+                 send_latency: float, cold: bool, only: List[str] = None) -> dict:
+    bench = HandlerBench(latency, error_rate, send_latency, cold)
+    return {
+        name: bench.run(make_call, iterations, concurrency)
+        for name, make_call in bench.workloads().items()
+        if not only or name in only
+    }
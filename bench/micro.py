@@ -0,0 +1,46 @@
+from itertools import cycle
+from time import perf_counter
+from typing import Callable, Dict
+
+from scoredb_bot.matcher import is_token, is_grade_id, is_class_id, is_student_id
+from scoredb_bot.renderer import render_students_pagination
+from scoredb_bot.utils import encode_data
+from .fakes import build_school
+from .stats import summarize
+
+
+def measure(func: Callable[[], object], iterations: int) -> dict:
+    samples = []
+    started = perf_counter()
+    for _ in range(iterations):
+        call_started = perf_counter()
+        func()
+        samples.append(perf_counter() - call_started)
+    return summarize(samples, perf_counter() - started)
+
+
+def micro_benchmarks() -> Dict[str, Callable[[], object]]:
+    school = build_school(grades=1, classes=1, students=40)
+    roster = next(iter(school['classes'].values())).students
+    page_ref = {'event_type': 'class', 'class_id': 'G1901', 'page': 2}
+    subjects = cycle(['G19', 'G1901', 'G190101', '20190101', '张三', '1|' + 'a' * 40])
+    page_ids = [s.id for s in roster[:9]]
+
+    return {
+        'render_students_pagination': lambda: render_students_pagination(roster, '', page_ref),
+        'encode_data.student': lambda: encode_data('student', student_id='G190101', from_page=page_ref),
+        'encode_data.all_photos': lambda: encode_data('all_photos', students=page_ids),
+        'encode_data.search': lambda: encode_data('search', query='张三', page=3),
+        'matcher.is_token': lambda: is_token(next(subjects)),
+        'matcher.is_grade_id': lambda: is_grade_id(next(subjects)),
+        'matcher.is_class_id': lambda: is_class_id(next(subjects)),
+        'matcher.is_student_id': lambda: is_student_id(next(subjects)),
+    }
+
+
+def run_micro(iterations: int, only=None) -> dict:
+    return {
+        name: measure(func, iterations)
+        for name, func in micro_benchmarks().items()
+        if not only or name.split('.')[0] in only
+    }
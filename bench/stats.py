@@ -0,0 +1,20 @@
+from math import ceil
+from typing import List
+
+
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(ceil(p / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def summarize(samples: List[float], elapsed: float) -> dict:
+    return {
+        'count': len(samples),
+        'throughput': len(samples) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+    }
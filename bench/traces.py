@@ -0,0 +1,92 @@
+import json
+from argparse import ArgumentParser
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from .stats import percentile
+
+
+def load(filenames: Iterable[str]) -> List[dict]:
+    traces = []
+    for filename in filenames:
+        with open(filename, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    traces.append(json.loads(line))
+                except ValueError:
+                    # The last line may be cut off while the bot is writing it.
+                    continue
+    return traces
+
+
+# A span's own time, i.e. without the time spent in its children. Children
+# run in parallel on other threads can add up to more than their parent, its
+# own time is then 0.
+def self_times(spans: List[dict]) -> List[float]:
+    result = [span['duration_ms'] for span in spans]
+    for span in spans:
+        if span.get('parent') is not None:
+            result[span['parent']] -= span['duration_ms']
+    return [max(time, 0.0) for time in result]
+
+
+def describe(span: dict) -> str:
+    tags = ' '.join(f'{k}={v}' for k, v in span.get('tags', {}).items())
+    return f'{span["name"]} {tags}'.strip()
+
+
+def print_slowest(traces: List[dict], top: int):
+    print(f'Slowest {min(top, len(traces))} of {len(traces)} traces:')
+    for trace in sorted(traces, key=lambda trace: trace['duration_ms'], reverse=True)[:top]:
+        print(f'\n{trace["trace_id"]} {trace.get("handler", "?")} key={trace.get("key")} '
+              f'{trace["duration_ms"]:.1f} ms (queued {trace.get("queued_ms", 0):.1f} ms)')
+        for span in trace['spans']:
+            print(f'  {span["start_ms"]:>9.1f} {span["duration_ms"]:>9.1f} ms  '
+                  f'{"  " * span["depth"]}{describe(span)}')
+
+
+def print_breakdown(traces: List[dict]):
+    durations: Dict[str, List[float]] = defaultdict(list)
+    own: Dict[str, float] = defaultdict(float)
+    cache: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for trace in traces:
+        spans = trace['spans']
+        for span, self_time in zip(spans, self_times(spans)):
+            name = span['name']
+            durations[name].append(span['duration_ms'])
+            own[name] += self_time
+            outcome = span.get('tags', {}).get('cache')
+            if outcome:
+                cache[name][outcome] += 1
+    total = sum(own.values())
+
+    print(f'\n{"span":<28} {"count":>7} {"p50_ms":>9} {"p95_ms":>9} {"max_ms":>9} {"self":>7}  cache')
+    for name, samples in sorted(durations.items(), key=lambda item: own[item[0]], reverse=True):
+        share = f'{own[name] / total * 100:.1f}%' if total else 'n/a'
+        outcomes = ' '.join(f'{k}={v}' for k, v in sorted(cache[name].items()))
+        print(f'{name:<28} {len(samples):>7} {percentile(samples, 50):>9.1f} '
+              f'{percentile(samples, 95):>9.1f} {max(samples):>9.1f} {share:>7}  {outcomes}')
+
+
+def main():
+    parser = ArgumentParser(description='Summarize traces written by the bot')
+    parser.add_argument('files', nargs='+', help='data/traces.jsonl and its rotated backups')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest traces to show')
+    parser.add_argument('--handler', help='only include traces of this handler')
+    args = parser.parse_args()
+
+    traces = load(args.files)
+    if args.handler:
+        traces = [trace for trace in traces if trace.get('handler') == args.handler]
+    if not traces:
+        print('No traces found')
+        return
+    print_slowest(traces, args.top)
+    print_breakdown(traces)
+
+
+if __name__ == '__main__':
+    main()
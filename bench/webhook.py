@@ -0,0 +1,81 @@
+import json
+import os
+import sys
+from argparse import ArgumentParser
+from http.client import HTTPConnection
+from queue import Queue
+from threading import Thread
+from time import perf_counter
+
+os.environ.setdefault('TELEGRAM_TOKEN', '0:bench')
+
+from scoredb_bot.webhook import SECRET_HEADER, WebhookServer  # noqa: E402
+from .stats import summarize  # noqa: E402
+
+
+def synthetic_update(update_id: int) -> bytes:
+    user = {'id': 1000 + update_id % 50, 'is_bot': False, 'first_name': 'Bench'}
+    return json.dumps({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user['id'], 'type': 'private'},
+            'from': user,
+            'text': 'G1901',
+        },
+    }).encode()
+
+
+def post_updates(port: int, path: str, secret: str, ids: range, latencies: list):
+    connection = HTTPConnection('127.0.0.1', port)
+    for update_id in ids:
+        body = synthetic_update(update_id)
+        started = perf_counter()
+        connection.request('POST', path, body, {'Content-Type': 'application/json', SECRET_HEADER: secret})
+        response = connection.getresponse()
+        response.read()
+        latencies.append(perf_counter() - started)
+        if response.status != 200:
+            raise RuntimeError(f'Unexpected status {response.status}')
+    connection.close()
+
+
+def main():
+    parser = ArgumentParser(description='Measure webhook ingress throughput with synthetic updates')
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    queue = Queue()
+    server = WebhookServer('127.0.0.1', 0, 'bench-secret', None, queue, workers=args.workers)
+    server.start()
+    received = []
+    consumer = Thread(target=lambda: [received.append(queue.get()) for _ in range(args.updates)], daemon=True)
+    consumer.start()
+
+    per_client = args.updates // args.concurrency
+    latencies = []
+    clients = [
+        Thread(target=post_updates,
+               args=(server.server_address[1], server.path, server.secret,
+                     range(i * per_client, args.updates if i == args.concurrency - 1 else (i + 1) * per_client),
+                     latencies))
+        for i in range(args.concurrency)
+    ]
+    started = perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    consumer.join()
+    elapsed = perf_counter() - started
+    server.stop()
+
+    json.dump({'webhook_ingress': summarize(latencies, elapsed)}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
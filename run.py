@@ -24,5 +24,8 @@ stream.setFormatter(formatter)
 logger.handlers = []
 logger.addHandler(stream)
 
-scoredb_bot.init()
-scoredb_bot.run()
+# Worker processes are spawned and import this module too, only the main
+# process may start the bot.
+if __name__ == '__main__':
+    scoredb_bot.init()
+    scoredb_bot.run()
@@ -1,33 +1,165 @@
 import logging
+import os
+import signal
+from threading import Event, Thread
 from typing import Optional
 
 from pytz import timezone
+from telegram import Bot
 from telegram.ext import Defaults, Updater
+from telegram.utils.request import Request
 
+from .cluster import WORKER_PROCESSES, Cluster, feed, poll
 from .commands import register_commands
-from .database import get_persistence
+from .database import DATA_DIR, get_persistence
 from .env import env
+from .metrics import Collector, handlers_in_progress, start_server
+from .sender import ScheduledBot
+from .serial import DISPATCHER_WORKERS, executor
+from .snapshot import SNAPSHOT_ENABLED, restore, save, snapshot_file
+from .tracing import start_tracing
+from .warmup import schedule_warm_up
+from .webhook import WebhookServer
 
 TOKEN = env.str('TELEGRAM_TOKEN')
 
+UPDATE_MODE = env.str('UPDATE_MODE', 'polling')
+WEBHOOK_LISTEN = env.str('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = env.int('WEBHOOK_PORT', 8443)
+WEBHOOK_SECRET = env.str('WEBHOOK_SECRET', '')
+WEBHOOK_URL = env.str('WEBHOOK_URL', None)
+WEBHOOK_WORKERS = env.int('WEBHOOK_WORKERS', 8)
+METRICS_LISTEN = env.str('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = env.int('METRICS_PORT', 0)
+
 updater: Optional[Updater] = None
+worker_index: Optional[int] = None
 
 
-def init():
+def init(worker: Optional[int] = None):
+    if worker is None and WORKER_PROCESSES > 1:
+        # The ingress process has no dispatcher, each worker initializes its own.
+        return
     logging.info('Initializing bot...')
 
-    global updater
-    updater = Updater(TOKEN, use_context=True,
-                      defaults=Defaults(tzinfo=timezone('Asia/Shanghai')),
+    global updater, worker_index
+    worker_index = worker
+    if SNAPSHOT_ENABLED:
+        restore(snapshot_file(worker))
+    # Worker processes write their own files, so rotation doesn't race.
+    start_tracing(DATA_DIR / (f'traces-{worker}.jsonl' if worker is not None else 'traces.jsonl'))
+    bot = ScheduledBot(TOKEN,
+                       defaults=Defaults(tzinfo=timezone('Asia/Shanghai')),
+                       request=Request(con_pool_size=env.int('SEND_WORKERS', 8) + DISPATCHER_WORKERS + 4))
+    # Handlers run on the serial executor, PTB's own pool only sends busy replies.
+    updater = Updater(bot=bot, use_context=True,
+                      workers=2,
                       persistence=get_persistence())
 
     register_commands(updater.dispatcher)
+    schedule_warm_up(updater.job_queue)
+
+    dispatcher = updater.dispatcher
+    Collector('scoredb_bot_dispatcher_queue_depth', 'Updates waiting to be dispatched',
+              lambda: [({}, dispatcher.update_queue.qsize())])
+    Collector('scoredb_bot_dispatcher_workers', 'Handler worker threads',
+              lambda: [({}, executor.workers)])
+    Collector('scoredb_bot_handlers_in_progress', 'Handlers currently running',
+              lambda: [({}, handlers_in_progress())])
+    Collector('scoredb_bot_worker_utilisation', 'Running handlers per dispatcher worker',
+              lambda: [({}, handlers_in_progress() / max(executor.workers, 1))])
+    if METRICS_PORT:
+        # Each worker process serves its own metrics on the next port.
+        start_server(METRICS_LISTEN, METRICS_PORT + (worker or 0))
 
     logging.info('Bot initialized')
 
 
+def save_snapshot():
+    if not SNAPSHOT_ENABLED:
+        return
+    try:
+        save(snapshot_file(worker_index))
+    except Exception as e:
+        logging.error(f'Failed to save cache snapshot: {e!r}')
+
+
+def start_dispatcher():
+    Thread(target=updater.dispatcher.start, name='dispatcher', daemon=True).start()
+    if updater.job_queue:
+        updater.job_queue.start()
+    # Lets Updater's signal handler flush persistence and stop the dispatcher
+    # and job queue, just like it does after start_polling.
+    updater.running = True
+
+
+def create_webhook_server(bot: Bot, update_queue) -> WebhookServer:
+    server = WebhookServer(WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET,
+                           bot, update_queue, workers=WEBHOOK_WORKERS)
+    if WEBHOOK_URL:
+        bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + server.path,
+                        max_connections=WEBHOOK_WORKERS,
+                        api_kwargs={'secret_token': WEBHOOK_SECRET})
+    return server
+
+
+def run_webhook():
+    server = create_webhook_server(updater.bot, updater.dispatcher.update_queue)
+    start_dispatcher()
+    server.start()
+    updater.idle()
+    server.stop()
+    save_snapshot()
+
+
+def feed_worker(queue):
+    feed(queue, updater.bot, updater.dispatcher.update_queue)
+    # Stops the worker through Updater's signal handler.
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def worker_main(index: int, queue):
+    init(worker=index)
+    start_dispatcher()
+    Thread(target=feed_worker, args=(queue,), name='feeder', daemon=True).start()
+    updater.idle()
+    save_snapshot()
+
+
+# The ingress process only receives updates and routes them to the workers.
+def run_cluster():
+    # Migrates the old pickle persistence once, before the workers open the database.
+    get_persistence().close()
+    cluster = Cluster(WORKER_PROCESSES, worker_main)
+    cluster.start()
+
+    stop = Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    bot = Bot(TOKEN)
+    try:
+        if UPDATE_MODE == 'webhook':
+            server = create_webhook_server(bot, cluster.router)
+            server.start()
+            stop.wait()
+            server.stop()
+        else:
+            poll(bot, cluster.router, stop)
+    finally:
+        # Also after e.g. a Conflict or Unauthorized error, the workers aren't daemons.
+        logging.info('Stopping worker processes...')
+        cluster.stop()
+
+
 def run():
+    if WORKER_PROCESSES > 1:
+        run_cluster()
+        return
     if updater is None:
         raise RuntimeError('Please initialize the bot first.')
-    updater.start_polling()
-    updater.idle()
+    if UPDATE_MODE == 'webhook':
+        run_webhook()
+    else:
+        updater.start_polling()
+        updater.idle()
+        save_snapshot()
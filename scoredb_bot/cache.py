@@ -1,14 +1,113 @@
+import json
+import logging
+import sqlite3
+from base64 import urlsafe_b64encode
+from collections import OrderedDict
+from hashlib import sha256
+from pathlib import Path
+from threading import RLock
+from time import time
 from typing import Optional, Any
-from uuid import uuid4 as uuid
 
-from expiringdict import ExpiringDict
 from telegram import Update
 
-cache = ExpiringDict(max_len=1000, max_age_seconds=60 * 60 * 24 * 30)
+from .database import DATA_DIR
+from .env import env
+from .metrics import Collector
+
+
+# Payloads are stored once under a short hash of their canonical JSON, so the
+# same payload rendered many times always maps to the same key.
+class OCStore:
+    def __init__(self, filename: Path, max_age: float, max_len: int,
+                 memory_len: int = 1024, compact_every: int = 500):
+        self.max_age = max_age
+        self.max_len = max_len
+        self.memory_len = memory_len
+        self.compact_every = compact_every
+        self.lock = RLock()
+        self.memory: 'OrderedDict[str, tuple]' = OrderedDict()
+        self.puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.connection = sqlite3.connect(str(filename), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS oc '
+                                    '(key TEXT PRIMARY KEY, value TEXT, created REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS oc_created ON oc (created)')
+
+    @staticmethod
+    def make_key(payload: str) -> str:
+        return urlsafe_b64encode(sha256(payload.encode()).digest()[:12]).decode()
+
+    def _remember(self, key: str, payload: str, created: float):
+        self.memory[key] = (payload, created)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_len:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time()
+        with self.lock:
+            if key in self.memory:
+                payload, created = self.memory[key]
+            else:
+                row = self.connection.execute('SELECT value, created FROM oc WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                payload, created = row
+            if now - created > self.max_age:
+                self.memory.pop(key, None)
+                self.expired += 1
+                return None
+            self._remember(key, payload, created)
+            self.hits += 1
+        return json.loads(payload)
+
+    def put(self, value: Any) -> str:
+        payload = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        key = self.make_key(payload)
+        now = time()
+        with self.lock:
+            cached = self.memory.get(key)
+            # Refreshing the age of a payload that was just written isn't worth a write.
+            if cached is not None and now - cached[1] < self.max_age / 100:
+                self.memory.move_to_end(key)
+                return key
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO oc (key, value, created) VALUES (?, ?, ?)',
+                                        (key, payload, now))
+            self._remember(key, payload, now)
+            self.puts += 1
+            if self.puts % self.compact_every == 0:
+                self.compact()
+        return key
+
+    def compact(self):
+        with self.lock, self.connection:
+            expired = self.connection.execute('DELETE FROM oc WHERE created < ?',
+                                              (time() - self.max_age,)).rowcount
+            evicted = self.connection.execute('DELETE FROM oc WHERE key IN '
+                                              '(SELECT key FROM oc ORDER BY created DESC LIMIT -1 OFFSET ?)',
+                                              (self.max_len,)).rowcount
+        self.expired += expired
+        self.evicted += evicted
+        if expired or evicted:
+            logging.debug(f'Compacted oc store: {expired} expired, {evicted} evicted')
+
+
+store = OCStore(DATA_DIR / 'oc.sqlite3',
+                max_age=env.int('OC_MAX_AGE', 60 * 60 * 24 * 30),
+                max_len=env.int('OC_MAX_LEN', 200000))
 
 
 def get_oc(key: str, update: Optional[Update] = None) -> Optional[Any]:
-    value = cache.get(key, None)
+    value = store.get(key)
     if not value and update and update.effective_message:
         update.effective_message.reply_text(text='此会话已过期，请重新发送你的请求',
                                             quote=True)
@@ -16,6 +115,9 @@ def get_oc(key: str, update: Optional[Update] = None) -> Optional[Any]:
 
 
 def put_oc(value) -> str:
-    key = str(uuid())
-    cache[key] = value
-    return key
+    return store.put(value)
+
+
+Collector('scoredb_bot_oc_total', 'Oversized callback payload store events',
+          lambda: [({'event': event}, getattr(store, event))
+                   for event in ('puts', 'hits', 'misses', 'expired', 'evicted')], 'counter')
@@ -0,0 +1,92 @@
+import logging
+import multiprocessing
+from queue import Queue
+from threading import Event
+from time import sleep
+from typing import Callable, List, Optional
+
+from telegram import Bot, Update
+from telegram.error import NetworkError, RetryAfter, TimedOut
+
+from .env import env
+
+WORKER_PROCESSES = env.int('WORKER_PROCESSES', 1)
+WORKER_QUEUE_SIZE = env.int('WORKER_QUEUE_SIZE', 1000)
+POLL_TIMEOUT = env.int('POLL_TIMEOUT', 10)
+
+
+def shard_key(update: Update) -> int:
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return update.update_id
+
+
+# Sends every update of a user to the same worker process, so each user's
+# updates are handled in order by one dispatcher and only that process ever
+# reads or writes the user's user_data.
+class Router:
+    def __init__(self, queues: List[multiprocessing.Queue]):
+        self.queues = queues
+
+    def put(self, update: Update):
+        self.queues[shard_key(update) % len(self.queues)].put(update.to_dict())
+
+
+# Worker processes are spawned rather than forked, so they don't inherit the
+# ingress process's threads and locks. `target(index, queue)` runs in each of
+# them.
+class Cluster:
+    def __init__(self, processes: int, target: Callable, args: tuple = (),
+                 queue_size: int = WORKER_QUEUE_SIZE):
+        context = multiprocessing.get_context('spawn')
+        self.queues = [context.Queue(maxsize=queue_size) for _ in range(processes)]
+        self.processes = [
+            context.Process(target=target, args=(index, queue, *args), name=f'worker-{index}')
+            for index, queue in enumerate(self.queues)
+        ]
+        self.router = Router(self.queues)
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        logging.info(f'Started {len(self.processes)} worker processes')
+
+    def stop(self, timeout: float = 30):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logging.warning(f'{process.name} did not stop in time, terminating it')
+                process.terminate()
+
+
+# Runs in a worker process until the ingress sends None.
+def feed(queue: multiprocessing.Queue, bot: Optional[Bot], update_queue: Queue):
+    while True:
+        data = queue.get()
+        if data is None:
+            return
+        update_queue.put(Update.de_json(data, bot))
+
+
+def poll(bot: Bot, router: Router, stop: Event):
+    bot.delete_webhook()
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = bot.get_updates(offset=offset, timeout=POLL_TIMEOUT)
+        except RetryAfter as e:
+            sleep(e.retry_after)
+            continue
+        except TimedOut:
+            continue
+        except NetworkError as e:
+            logging.warning(f'Polling failed: {e!r}')
+            sleep(1)
+            continue
+        for update in updates:
+            router.put(update)
+            offset = update.update_id + 1
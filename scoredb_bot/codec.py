@@ -0,0 +1,178 @@
+import re
+from base64 import b85decode, b85encode
+from typing import List, Optional, Tuple
+
+PREFIX = '~'
+
+INT = 'int'
+STR = 'str'
+ID = 'id'
+ID_LIST = 'id_list'
+REF = 'ref'
+
+# Tags are part of the wire format: never renumber them, only append.
+SCHEMAS = {
+    'auth': (1, ()),
+    're_auth': (2, ()),
+    'class': (3, (('class_id', ID), ('page', INT))),
+    'student': (4, (('student_id', ID), ('from_page', REF))),
+    'search': (5, (('query', STR), ('page', INT))),
+    'photos': (6, (('student_id', ID),)),
+    'all_photos': (7, (('students', ID_LIST),)),
+    'bulk': (8, (('key', STR), ('page', INT))),
+    'bulk_csv': (9, (('key', STR),)),
+}
+
+TAGS = {tag: (event_type, fields) for event_type, (tag, fields) in SCHEMAS.items()}
+
+ID_LETTERS = ' xXcCgG'
+ID_PATTERN = re.compile(r'^([xXcCgG]?)([0-9]{1,8})$')
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _write_varint(out: bytearray, value: int):
+    if value < 0:
+        raise CodecError('Negative integers are not supported')
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        if pos >= len(data):
+            raise CodecError('Truncated data')
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _write_str(out: bytearray, value: str):
+    raw = value.encode()
+    _write_varint(out, len(raw))
+    out += raw
+
+
+def _read_str(data: bytes, pos: int) -> Tuple[str, int]:
+    length, pos = _read_varint(data, pos)
+    if pos + length > len(data):
+        raise CodecError('Truncated data')
+    return data[pos:pos + length].decode(), pos + length
+
+
+# IDs like G190101 or 20190101 are packed into a single varint holding the
+# digits, the digit count and the prefix letter. The lowest bit tells packed
+# IDs apart from IDs stored as plain strings.
+def _write_id(out: bytearray, value: str):
+    match = ID_PATTERN.match(value)
+    if match:
+        letter, digits = match.groups()
+        packed = (int(digits) * 16 + len(digits)) * 8 + ID_LETTERS.index(letter or ' ')
+        _write_varint(out, packed << 1 | 1)
+    else:
+        raw = value.encode()
+        _write_varint(out, len(raw) << 1)
+        out += raw
+
+
+def _read_id(data: bytes, pos: int) -> Tuple[str, int]:
+    value, pos = _read_varint(data, pos)
+    if value & 1:
+        value >>= 1
+        letter = ID_LETTERS[value % 8].strip()
+        value //= 8
+        length = value % 16
+        return letter + str(value // 16).zfill(length), pos
+    length = value >> 1
+    if pos + length > len(data):
+        raise CodecError('Truncated data')
+    return data[pos:pos + length].decode(), pos + length
+
+
+def _write_record(out: bytearray, event_type: Optional[str], kwargs: dict):
+    if event_type not in SCHEMAS:
+        raise CodecError(f'Unknown event type {event_type!r}')
+    tag, fields = SCHEMAS[event_type]
+    names = [name for name, _ in fields]
+    for name, value in kwargs.items():
+        if name not in names and value is not None:
+            raise CodecError(f'Unknown field {name!r} for {event_type!r}')
+    present = [(i, kind, kwargs[name]) for i, (name, kind) in enumerate(fields)
+               if kwargs.get(name) is not None]
+    _write_varint(out, tag)
+    _write_varint(out, sum(1 << i for i, _, _ in present))
+    for _, kind, value in present:
+        if kind == INT:
+            if type(value) != int:
+                raise CodecError(f'Expected int, got {value!r}')
+            _write_varint(out, value)
+        elif kind == STR:
+            _write_str(out, str(value))
+        elif kind == ID:
+            _write_id(out, str(value))
+        elif kind == ID_LIST:
+            _write_varint(out, len(value))
+            for item in value:
+                _write_id(out, str(item))
+        elif kind == REF:
+            ref = dict(value)
+            _write_record(out, ref.pop('event_type', None), ref)
+
+
+def _read_record(data: bytes, pos: int) -> Tuple[str, dict, int]:
+    tag, pos = _read_varint(data, pos)
+    if tag not in TAGS:
+        raise CodecError(f'Unknown tag {tag}')
+    event_type, fields = TAGS[tag]
+    present, pos = _read_varint(data, pos)
+    kwargs = {}
+    for i, (name, kind) in enumerate(fields):
+        if not present & (1 << i):
+            continue
+        if kind == INT:
+            kwargs[name], pos = _read_varint(data, pos)
+        elif kind == STR:
+            kwargs[name], pos = _read_str(data, pos)
+        elif kind == ID:
+            kwargs[name], pos = _read_id(data, pos)
+        elif kind == ID_LIST:
+            count, pos = _read_varint(data, pos)
+            items: List[str] = []
+            for _ in range(count):
+                item, pos = _read_id(data, pos)
+                items.append(item)
+            kwargs[name] = items
+        elif kind == REF:
+            ref_type, ref, pos = _read_record(data, pos)
+            kwargs[name] = {'event_type': ref_type, **ref}
+    return event_type, kwargs, pos
+
+
+def encode(event_type: Optional[str], kwargs: dict) -> str:
+    out = bytearray()
+    _write_record(out, event_type, kwargs)
+    return PREFIX + b85encode(bytes(out)).decode()
+
+
+def decode(raw: str) -> dict:
+    if not raw.startswith(PREFIX):
+        raise CodecError('Not a compact payload')
+    try:
+        data = b85decode(raw[len(PREFIX):])
+    except ValueError as e:
+        raise CodecError(str(e)) from e
+    event_type, kwargs, _ = _read_record(data, 0)
+    kwargs['type'] = event_type
+    return kwargs
+
+
+def is_compact(raw: str) -> bool:
+    return raw.startswith(PREFIX)
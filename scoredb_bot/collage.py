@@ -0,0 +1,101 @@
+import logging
+from functools import lru_cache
+from hashlib import sha1
+from io import BytesIO
+from math import ceil, sqrt
+from typing import List, Optional, Tuple
+
+from requests import Session
+
+from .env import env
+from .transport import adapter
+
+try:
+    from PIL import Image, ImageDraw, ImageFont, ImageOps
+except ImportError:
+    Image = None
+
+TILE_WIDTH = 300
+TILE_HEIGHT = 400
+LABEL_HEIGHT = 36
+PADDING = 8
+BACKGROUND = (255, 255, 255)
+TEXT_COLOR = (32, 32, 32)
+
+# A font with CJK glyphs is needed to label tiles with student names, without
+# one only the IDs are drawn.
+COLLAGE_FONT = env.str('PHOTO_COLLAGE_FONT', None)
+
+COLLAGE_ENABLED = env.bool('PHOTO_COLLAGE', False)
+if COLLAGE_ENABLED and Image is None:
+    logging.warning('Photo collages need Pillow, sending media groups instead.')
+    COLLAGE_ENABLED = False
+
+session = Session()
+session.mount('https://', adapter)
+session.mount('http://', adapter)
+
+# (student_id, name, photo URL)
+Tile = Tuple[str, str, str]
+
+
+def collage_key(tiles: List[Tile]) -> str:
+    return sha1(repr(tiles).encode()).hexdigest()
+
+
+def download(url: str) -> bytes:
+    response = session.get(url)
+    response.raise_for_status()
+    return response.content
+
+
+@lru_cache(maxsize=1)
+def load_font():
+    if COLLAGE_FONT:
+        try:
+            return ImageFont.truetype(COLLAGE_FONT, 20)
+        except OSError as e:
+            logging.warning(f'Failed to load collage font "{COLLAGE_FONT}": {e!r}')
+    return None
+
+
+def decode_tile(data: bytes) -> 'Image.Image':
+    image = Image.open(BytesIO(data))
+    # Lets the JPEG decoder scale down while decoding instead of after.
+    image.draft('RGB', (TILE_WIDTH, TILE_HEIGHT))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    return ImageOps.fit(image, (TILE_WIDTH, TILE_HEIGHT), Image.LANCZOS)
+
+
+# Returns the JPEG and the number of photos in it.
+def render_collage(tiles: List[Tuple[Tile, bytes]]) -> Optional[Tuple[BytesIO, int]]:
+    decoded = []
+    for tile, data in tiles:
+        try:
+            decoded.append((tile, decode_tile(data)))
+        except Exception as e:
+            logging.warning(f'Failed to decode photo of {tile[0]}: {e!r}')
+    if not decoded:
+        return None
+
+    columns = ceil(sqrt(len(decoded)))
+    rows = ceil(len(decoded) / columns)
+    cell_width = TILE_WIDTH + PADDING
+    cell_height = TILE_HEIGHT + LABEL_HEIGHT + PADDING
+    canvas = Image.new('RGB', (columns * cell_width + PADDING, rows * cell_height + PADDING), BACKGROUND)
+    draw = ImageDraw.Draw(canvas)
+    font = load_font()
+    label_font = font or ImageFont.load_default()
+    for i, ((student_id, name, _url), image) in enumerate(decoded):
+        x = PADDING + i % columns * cell_width
+        y = PADDING + i // columns * cell_height
+        canvas.paste(image, (x, y))
+        label = f'{student_id} {name}' if font else student_id
+        text_width = draw.textlength(label, font=label_font)
+        draw.text((x + (TILE_WIDTH - text_width) / 2, y + TILE_HEIGHT + 8), label,
+                  fill=TEXT_COLOR, font=label_font)
+
+    output = BytesIO()
+    canvas.save(output, format='JPEG', quality=85, optimize=True)
+    output.seek(0)
+    return output, len(decoded)
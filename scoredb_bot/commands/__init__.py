@@ -1,27 +1,38 @@
-from telegram.ext import Dispatcher
+from telegram.ext import Dispatcher, Handler
 
 from ._callback import callback_handler
-from ._error import error_handler
+from ._error import error_handler, errors_handler, schedule_error_digest
 from ._inline import inline_search_handler
 from .auth import auth_handler, input_token_handler
 from .help import help_handler
 from .search import command_search_handler, message_search_handler
 from .start import start_handler
+from ..metrics import instrument_handler
+from ..serial import run_serial
+
+
+# Every handler runs on the handler pool, in order for each user.
+def add_handler(dispatcher: Dispatcher, handler: Handler, supersede: bool = False):
+    handler.callback = run_serial(instrument_handler(handler.callback.__name__, handler.callback), supersede)
+    dispatcher.add_handler(handler)
 
 
 def register_commands(dispatcher: Dispatcher):
-    dispatcher.add_handler(start_handler)
+    add_handler(dispatcher, start_handler)
+
+    add_handler(dispatcher, help_handler)
 
-    dispatcher.add_handler(help_handler)
+    add_handler(dispatcher, auth_handler)
+    add_handler(dispatcher, input_token_handler)
 
-    dispatcher.add_handler(auth_handler)
-    dispatcher.add_handler(input_token_handler)
+    add_handler(dispatcher, command_search_handler)
+    add_handler(dispatcher, message_search_handler)
 
-    dispatcher.add_handler(command_search_handler)
-    dispatcher.add_handler(message_search_handler)
+    add_handler(dispatcher, inline_search_handler, supersede=True)
 
-    dispatcher.add_handler(inline_search_handler)
+    add_handler(dispatcher, callback_handler)
 
-    dispatcher.add_handler(callback_handler)
+    add_handler(dispatcher, errors_handler)
 
     dispatcher.add_error_handler(error_handler)
+    schedule_error_digest(dispatcher.job_queue)
@@ -1,12 +1,13 @@
-import json
-
 from telegram import Update
 from telegram.ext import CallbackContext, CallbackQueryHandler
 
 from .auth import auth_callback, re_auth_callback
+from .bulk import bulk_callback, bulk_csv_callback
 from .photos import photos_callback, all_photos_callback
 from .search import class_callback, student_callback, search_callback
-from ..cache import get_oc
+from ..metrics import callback_latency
+from ..throttle import THROTTLED_MESSAGE, Throttled
+from ..utils import decode_data
 
 callbacks = {
     'auth': auth_callback,
@@ -15,13 +16,15 @@ callbacks = {
     'student': student_callback,
     'search': search_callback,
     'photos': photos_callback,
-    'all_photos': all_photos_callback
+    'all_photos': all_photos_callback,
+    'bulk': bulk_callback,
+    'bulk_csv': bulk_csv_callback
 }
 
 
-def answer(update: Update, context: CallbackContext):
+def answer(update: Update, context: CallbackContext, text: str = None):
     try:
-        context.bot.answer_callback_query(update.callback_query.id)
+        context.bot.answer_callback_query(update.callback_query.id, text=text)
     except Exception:  # What may this method throw?
         pass
 
@@ -29,14 +32,15 @@ def answer(update: Update, context: CallbackContext):
 def callback(update: Update, context: CallbackContext):
     raw_data = update.callback_query.data
     if raw_data:
-        if raw_data[:3] == 'oc:':
-            data: dict = get_oc(raw_data[3:], update)
-        else:
-            data: dict = json.loads(update.callback_query.data)
+        data: dict = decode_data(raw_data, update)
         if data:
             event_type = data.pop('type', None)
             if event_type in callbacks.keys():
-                callbacks[event_type](update, context, **data)
+                try:
+                    with callback_latency.time(event_type):
+                        callbacks[event_type](update, context, **data)
+                except Throttled:
+                    return answer(update, context, THROTTLED_MESSAGE)
     answer(update, context)
 
 
@@ -1,38 +1,114 @@
 import logging
-from sys import exc_info
+from html import escape
+from math import ceil
 from traceback import format_tb
 
 from telegram import Update, ParseMode
-from telegram.ext import CallbackContext
+from telegram.ext import CallbackContext, CommandHandler, JobQueue
 from telegram.utils.helpers import mention_html
 
 from ..env import env
+from ..errors import ERROR_DIGEST_INTERVAL, aggregator
+from ..sender import send_lane, REPORT
 
 DEVELOPER_ID = env.str('DEVELOPER_ID', None)
+MESSAGE_LIMIT = 4000
+# Tracebacks are cut to this length before they are escaped, leaving room for
+# the rest of the message. Cutting the HTML could split a tag or an entity.
+TRACEBACK_LIMIT = 3000
 
 if DEVELOPER_ID is None:
     logging.warning('Developer ID not set, error messages will not be sent.')
 
 
+# Keeps the end of a traceback, where the error is, and escapes it.
+def format_traceback(exception: str) -> str:
+    if len(exception) > TRACEBACK_LIMIT:
+        exception = '...' + exception[-TRACEBACK_LIMIT:]
+    return f'<code>Traceback:\n{escape(exception)}</code>'
+
+
+def send_report(context: CallbackContext, message: str):
+    if DEVELOPER_ID is None:
+        return
+    with send_lane(REPORT):
+        context.bot.send_message(DEVELOPER_ID,
+                                 text=message,
+                                 parse_mode=ParseMode.HTML)
+
+
 def error_handler(update: Update, context: CallbackContext):
     if update.effective_message:
         message = '我在处理这条消息期间遇到了一个错误，相关信息已被反馈至开发者'
         update.effective_message.reply_text(text=message)
-    trace = '\n'.join(format_tb(exc_info()[2]))
+    trace = ''.join(format_tb(context.error.__traceback__))
+    exception = f'{trace}\n{type(context.error).__name__}: {context.error}'
+    user_id = update.effective_user.id if update.effective_user else None
+    stats, report = aggregator.record(context.error, user_id, exception)
+    if not report:
+        # Repeats are only counted here and reported by the digest.
+        raise context.error
     payload = ''
     if update.effective_user:
         mention = mention_html(update.effective_user.id,
                                update.effective_user.name)
         payload += f'在与 {mention} '
     if update.effective_chat and update.effective_chat.title:
-        payload += f'在 {update.effective_chat.title} 中'
+        payload += f'在 {escape(update.effective_chat.title)} 中'
     if update.effective_user:
         payload += '聊天时'
     if update.poll:
         payload += f'在 Poll ({update.poll.id}) 中'
-    exception = f'{trace}\n{type(context.error).__name__}: {context.error}'
-    message = f'我{payload}遇到了一个错误：\n\n<code>Traceback:\n{exception}</code>'
-    context.bot.send_message(DEVELOPER_ID,
-                             text=message,
-                             parse_mode=ParseMode.HTML)
-    raise
+    message = f'我{payload}遇到了一个错误 <code>{stats.fingerprint}</code>：\n\n' \
+              f'{format_traceback(exception)}'
+    send_report(context, message)
+    raise context.error
+
+
+def send_error_digest(context: CallbackContext):
+    repeated = aggregator.drain()
+    if not repeated:
+        return
+    message = f'过去 {ceil(ERROR_DIGEST_INTERVAL / 60)} 分钟内重复出现的错误：\n'
+    for stats, count, users in repeated:
+        entry = f'\n<code>{stats.fingerprint}</code> {stats.name}: {escape(stats.message)}\n' \
+                f'重复 {count} 次，影响 {users} 名用户（累计 {stats.total} 次，{len(stats.users)} 名用户）\n'
+        if len(message) + len(entry) > MESSAGE_LIMIT:
+            break
+        message += entry
+    send_report(context, message)
+
+
+# /errors lists the most frequent errors, /errors <fingerprint> shows its latest traceback.
+def errors_command(update: Update, context: CallbackContext):
+    if str(update.effective_user.id) != DEVELOPER_ID:
+        return
+    if context.args:
+        trace = aggregator.recent(context.args[0])
+        if trace is None:
+            update.effective_message.reply_text(text='没有找到这个错误的记录', quote=True)
+            return
+        _time, fingerprint, user_id, exception = trace
+        message = f'<code>{fingerprint}</code> 最近一次出现（用户 {user_id}）：\n\n' \
+                  f'{format_traceback(exception)}'
+    else:
+        top = aggregator.top()
+        if not top:
+            update.effective_message.reply_text(text='还没有出现过错误', quote=True)
+            return
+        message = '出现次数最多的错误：\n'
+        for stats in top:
+            entry = f'\n<code>{stats.fingerprint}</code> {stats.name}: {escape(stats.message)}\n' \
+                    f'共 {stats.total} 次，影响 {len(stats.users)} 名用户\n'
+            if len(message) + len(entry) > MESSAGE_LIMIT:
+                break
+            message += entry
+    update.effective_message.reply_text(text=message, parse_mode=ParseMode.HTML, quote=True)
+
+
+def schedule_error_digest(job_queue: JobQueue):
+    job_queue.run_repeating(send_error_digest, interval=ERROR_DIGEST_INTERVAL,
+                            first=ERROR_DIGEST_INTERVAL, name='error_digest')
+
+
+errors_handler = CommandHandler('errors', errors_command)
@@ -1,22 +1,78 @@
+from time import sleep
+from typing import List, Optional, Tuple
+
+from scoredb.models import StudentSummary
 from telegram import InputTextMessageContent, Update, InlineQueryResultArticle, ParseMode
 from telegram.ext import CallbackContext, InlineQueryHandler
 from telegram.utils.helpers import mention_html
 
+from ..env import env
 from ..fetcher import request_search
+from ..serial import is_superseded
+from ..throttle import Throttled
 from ..utils import verify_auth, gender_emoji
 
+PAGE_SIZE = 20
+DEBOUNCE = env.float('INLINE_DEBOUNCE', 0.3)
+
+
+# Waits for further keystrokes, returns whether the query is still the latest.
+# Newer queries are recorded when they are submitted, before they queue up
+# behind this one.
+def debounce() -> bool:
+    if DEBOUNCE > 0:
+        sleep(DEBOUNCE)
+    return not is_superseded()
+
+
+def matches(student: StudentSummary, query: str) -> bool:
+    query = query.lower()
+    return query in student.id.lower() or query in student.name.lower()
+
+
+# A query that extends one whose first page already held every result can be
+# answered by filtering that page locally.
+def search_locally(token: str, query: str) -> Optional[List[StudentSummary]]:
+    for end in range(len(query) - 1, 0, -1):
+        cached = request_search.peek(token, query[:end], 1, PAGE_SIZE)
+        if cached is not None and cached.pages <= 1:
+            return [student for student in cached.data if matches(student, query)]
+    return None
+
+
+def search_page(token: str, query: str, page: int) -> Tuple[List[StudentSummary], bool]:
+    if page == 1 or request_search.peek(token, query, 1, PAGE_SIZE) is None:
+        students = search_locally(token, query)
+        if students is not None:
+            return students[(page - 1) * PAGE_SIZE:page * PAGE_SIZE], len(students) > page * PAGE_SIZE
+    pagination = request_search(token, query, page, PAGE_SIZE)
+    return pagination.data, pagination.has_next_page()
+
 
 def inline_search(update: Update, context: CallbackContext):
     query = update.inline_query.query.strip()
     results = []
+    next_offset = ''
+    cache_time = 60
     mention = mention_html(context.bot.id, f'@{context.bot.username}')
 
     if query and verify_auth(context.user_data):
+        offset = update.inline_query.offset
+        if not offset and not debounce():
+            return
 
         token = context.user_data.get('token')
-        search_result = request_search(token, query, page_size=20)
+        page = int(offset) if offset.isdigit() else 1
+        try:
+            students, has_next_page = search_page(token, query, page)
+        except Throttled:
+            # Not cached by Telegram, the query works again once the limit clears.
+            students, has_next_page = [], False
+            cache_time = 0
+        if has_next_page:
+            next_offset = str(page + 1)
 
-        for student in search_result.data:
+        for student in students:
             gender = gender_emoji(student.gender)
             message = f'🔍 “<strong>{query}</strong>” 的搜索结果：\n\n'
             message += f'🧑‍🎓 <strong>{student.id} {student.name}</strong> {gender}\n\n'
@@ -38,8 +94,9 @@ def inline_search(update: Update, context: CallbackContext):
                 )
             )
     context.bot.answer_inline_query(update.inline_query.id, results,
-                                    cache_time=60,
-                                    is_personal=True)
+                                    cache_time=cache_time,
+                                    is_personal=True,
+                                    next_offset=next_offset)
 
 
-inline_search_handler = InlineQueryHandler(inline_search, run_async=True)
+inline_search_handler = InlineQueryHandler(inline_search)
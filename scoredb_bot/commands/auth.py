@@ -1,9 +1,9 @@
 from requests import RequestException
-from scoredb import Client
 from telegram import Update, ChatAction, ParseMode, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import CallbackContext, CommandHandler, MessageHandler, Filters
 from telegram.utils.helpers import mention_html
 
+from ..fetcher import get_client
 from ..matcher import is_token
 from ..utils import send_action, is_group, verify_auth, encode_data
 
@@ -54,8 +54,7 @@ def on_input_token(update: Update, context: CallbackContext):
                                                     f'正在检查密钥有效性...',
                                                parse_mode=ParseMode.HTML)
             try:
-                client = Client(token)
-                context.user_data['user'] = client.users.get_current_user()
+                context.user_data['user'] = get_client(token).users.get_current_user()
                 context.user_data['token'] = token
             except RequestException:
                 pass
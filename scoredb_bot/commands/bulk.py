@@ -0,0 +1,151 @@
+import csv
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from math import ceil
+from typing import Any, List, Optional, Tuple
+
+from requests import RequestException
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, ChatAction
+from telegram.ext import CallbackContext
+
+from ..cache import get_oc, put_oc
+from ..env import env
+from ..fetcher import fetch_grade, fetch_class, fetch_student
+from ..throttle import MAX_WAIT, THROTTLED_MESSAGE, Throttled, batch, limiter
+from ..tracing import propagate
+from ..utils import encode_data, update_or_reply, gender_emoji
+
+BULK_MAX_IDS = env.int('BULK_MAX_IDS', 500)
+BULK_MAX_WAIT = env.float('BULK_MAX_WAIT', 600)
+BULK_PAGE_SIZE = 20
+
+executor = ThreadPoolExecutor(max_workers=env.int('BULK_WORKERS', 8),
+                              thread_name_prefix='bulk')
+
+fetchers = {
+    'grade': fetch_grade,
+    'class': fetch_class,
+    'student': fetch_student,
+}
+
+FAILED = 'failed'
+THROTTLED = 'throttled'
+
+# (kind, id, fetched value, FAILED/THROTTLED if the request failed)
+Result = Tuple[str, str, Any, Optional[str]]
+
+
+def fetch_one(token: str, item: List[str], max_wait: float) -> Result:
+    kind, id_ = item
+    try:
+        with batch(max_wait):
+            return kind, id_, fetchers[kind](token, id_), None
+    except Throttled:
+        return kind, id_, None, THROTTLED
+    except RequestException as e:
+        logging.warning(f'Bulk lookup of {id_} failed: {e!r}')
+        return kind, id_, None, FAILED
+
+
+# The lookups of a batch queue up for the token's rate limit instead of failing
+# past its burst, the last one may wait about as long as the whole batch takes.
+def batch_wait(token: str, count: int) -> float:
+    rate = limiter.token_rate(token)
+    if rate <= 0:
+        return MAX_WAIT
+    return min(MAX_WAIT + count / rate, BULK_MAX_WAIT)
+
+
+def fetch_all(token: str, items: List[List[str]]) -> List[Result]:
+    max_wait = batch_wait(token, len(items))
+    return list(executor.map(propagate(lambda item: fetch_one(token, item, max_wait)), items))
+
+
+def render_line(result: Result) -> str:
+    kind, id_, value, error = result
+    if error == THROTTLED:
+        return f'⏳ <strong>{id_}</strong> 查询过于频繁，暂未查询'
+    if error:
+        return f'⚠ <strong>{id_}</strong> 查询失败'
+    if value is None:
+        return f'❔ <strong>{id_}</strong> 未找到'
+    if kind == 'grade':
+        return f'🏫 <strong>{value.id}</strong> 年级 — {value.classesCount} 个班级，{value.studentsCount} 名学生'
+    if kind == 'class':
+        return f'🧑‍🏫 <strong>{value.id}</strong> 班 — {value.studentsCount} 名学生'
+    return f'🧑‍🎓 <strong>{value.id}</strong> {value.name} {gender_emoji(value.gender)} {value.classId}'
+
+
+def render_bulk(update: Update, context: CallbackContext,
+                key: str, items: List[List[str]], results: List[Result], page: int):
+    pages = ceil(len(items) / BULK_PAGE_SIZE)
+    found = sum(1 for result in results if result[2] is not None)
+    message = f'📋 批量查询了 {len(items)} 个 ID\n\n'
+    message += f'正在显示第 {page} / {pages} 页：\n'
+    message += '\n'.join(render_line(result) for result in results)
+    if len(results) == len(items):
+        message += f'\n\n共找到 {found} 条结果'
+    if any(result[3] == THROTTLED for result in results):
+        message += f'\n\n{THROTTLED_MESSAGE}'
+
+    switch_page_buttons = []
+    if page > 1:
+        switch_page_buttons.append(
+            InlineKeyboardButton('上一页', callback_data=encode_data('bulk', key=key, page=page - 1))
+        )
+    if page < pages:
+        switch_page_buttons.append(
+            InlineKeyboardButton('下一页', callback_data=encode_data('bulk', key=key, page=page + 1))
+        )
+    buttons = [switch_page_buttons] if switch_page_buttons else []
+    buttons.append([InlineKeyboardButton('导出 CSV', callback_data=encode_data('bulk_csv', key=key))])
+    update_or_reply(update, context,
+                    text=message,
+                    reply_markup=InlineKeyboardMarkup(buttons),
+                    parse_mode=ParseMode.HTML)
+
+
+def bulk_search(update: Update, context: CallbackContext, ids: List[Tuple[str, str]]):
+    if len(ids) > BULK_MAX_IDS:
+        return update_or_reply(update, context,
+                               text=f'一次最多只能批量查询 {BULK_MAX_IDS} 个 ID，你发送了 {len(ids)} 个')
+    items = [list(item) for item in ids]
+    key = put_oc({'items': items})
+    bulk_callback(update, context, key, 1, items)
+
+
+def bulk_callback(update: Update, context: CallbackContext,
+                  key: str, page: int = 1, items: Optional[List[List[str]]] = None):
+    if items is None:
+        payload = get_oc(key, update)
+        if not payload:
+            return
+        items = payload['items']
+    token = context.user_data.get('token', None)
+    pages = ceil(len(items) / BULK_PAGE_SIZE)
+    page = min(max(page, 1), pages)
+    page_items = items[(page - 1) * BULK_PAGE_SIZE:page * BULK_PAGE_SIZE]
+    render_bulk(update, context, key, items, fetch_all(token, page_items), page)
+
+
+def bulk_csv_callback(update: Update, context: CallbackContext, key: str):
+    payload = get_oc(key, update)
+    if not payload:
+        return
+    token = context.user_data.get('token', None)
+    update.effective_chat.send_chat_action(ChatAction.UPLOAD_DOCUMENT)
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['type', 'id', 'status', 'name', 'gender', 'class_id', 'classes_count', 'students_count'])
+    for kind, id_, value, error in fetch_all(token, payload['items']):
+        if error or value is None:
+            writer.writerow([kind, id_, error or 'not_found', '', '', '', '', ''])
+        elif kind == 'grade':
+            writer.writerow([kind, id_, 'ok', '', '', '', value.classesCount, value.studentsCount])
+        elif kind == 'class':
+            writer.writerow([kind, id_, 'ok', '', '', '', '', value.studentsCount])
+        else:
+            writer.writerow([kind, id_, 'ok', value.name, value.gender, value.classId, '', ''])
+    document = BytesIO(output.getvalue().encode('utf-8-sig'))
+    update.effective_message.reply_document(document=document, filename='studentdb.csv', quote=True)
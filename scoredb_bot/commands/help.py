@@ -27,4 +27,4 @@ def help_command(update: Update, _context):
         update.effective_chat.send_message(text=message, parse_mode=ParseMode.HTML)
 
 
-help_handler = CommandHandler('help', help_command, run_async=True)
+help_handler = CommandHandler('help', help_command)
@@ -1,41 +1,204 @@
-from typing import List
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import monotonic
+from typing import Iterator, List, Optional, Tuple
 
-from telegram import Update, ChatAction, InputMediaPhoto
+from requests import RequestException
+from telegram import Update, ChatAction, InputMediaPhoto, Message
+from telegram.error import BadRequest
 from telegram.ext import CallbackContext
 
-from ..fetcher import fetch_student_photos
+from ..collage import COLLAGE_ENABLED, Tile, collage_key, download, load_font, render_collage
+from ..env import env
+from ..fetcher import fetch_student, fetch_student_photos
+from ..photo_cache import store as file_ids
+from ..throttle import THROTTLED_MESSAGE, Throttled
+from ..tracing import propagate
 from ..utils import send_action
 
+MEDIA_GROUP_SIZE = 10
+# Seconds between edits of the progress message.
+PROGRESS_INTERVAL = 1.5
 
-@send_action(ChatAction.UPLOAD_PHOTO)
-def send_photos(update: Update, photos: List[str]):
+# (student_id, photo URL)
+Photo = Tuple[str, str]
+
+executor = ThreadPoolExecutor(max_workers=env.int('PHOTO_FETCH_WORKERS', 8),
+                              thread_name_prefix='photos')
+
+
+def reply_photos(update: Update, photos: List[str]) -> List[Message]:
+    if len(photos) == 1:
+        return [update.effective_message.reply_photo(photo=photos[0], quote=True)]
     medias = [InputMediaPhoto(i) for i in photos]
-    update.effective_message.reply_media_group(media=medias, quote=True)
+    return update.effective_message.reply_media_group(media=medias, quote=True)
+
+
+def send_media_group(update: Update, photos: List[Photo]):
+    known = file_ids.get(photos)
+    try:
+        messages = reply_photos(update, [known.get(photo, photo[1]) for photo in photos])
+    except BadRequest:
+        if not known:
+            raise
+        file_ids.forget(known.keys())
+        known = {}
+        messages = reply_photos(update, [url for _, url in photos])
+    file_ids.put({photo: message.photo[-1].file_id
+                  for photo, message in zip(photos, messages)
+                  if photo not in known and message.photo})
+
+
+@send_action(ChatAction.UPLOAD_PHOTO)
+def send_photos(update: Update, photos: List[Photo]):
+    for i in range(0, len(photos), MEDIA_GROUP_SIZE):
+        send_media_group(update, photos[i:i + MEDIA_GROUP_SIZE])
 
 
 def photos_callback(update: Update, context: CallbackContext,
                     student_id: str):
     token = context.user_data.get('token', None)
     photos = fetch_student_photos(token, student_id)
+    file_ids.sync(student_id, photos)
     if len(photos) == 0:
         update.effective_chat.send_chat_action(ChatAction.TYPING)
         update.effective_message.reply_text(text='未找到请求的照片，可能是由于获取照片所需的数据不足',
                                             quote=True)
     else:
-        send_photos(update, photos)
+        send_photos(update, [(student_id, url) for url in photos])
+
+
+def fetch_first_photo(token: str, student_id: str) -> Optional[Photo]:
+    photos = fetch_student_photos(token, student_id)
+    file_ids.sync(student_id, photos)
+    return (student_id, photos[0]) if photos else None
+
+
+def result_text(sent: str, failed: int, throttled: int) -> str:
+    text = f'已发送 {sent}'
+    if failed > 0:
+        text += f'，其中 {failed} 名学生的照片获取失败'
+    if throttled > 0:
+        text += f'\n{throttled} 名学生的照片未能获取，{THROTTLED_MESSAGE}'
+    return text
+
+
+# Names only come from cached student details, usually warmed by prefetching
+# the page, a label isn't worth a ScoreDB request.
+def student_name(token: str, student_id: str) -> str:
+    student = fetch_student.peek(token, student_id)
+    return student.name if student else ''
+
+
+def try_download(tile: Tile) -> Optional[bytes]:
+    try:
+        return download(tile[2])
+    except RequestException as e:
+        logging.warning(f'Failed to download photo of {tile[0]}: {e!r}')
+        return None
+
+
+# Sends the photos as one labelled grid image. Returns how many photos it
+# holds, or 0 if none of them could be downloaded and decoded.
+@send_action(ChatAction.UPLOAD_PHOTO)
+def send_collage(update: Update, token: str, photos: List[Photo]) -> int:
+    # Without a CJK font names aren't drawn, so they aren't looked up.
+    labelled = load_font() is not None
+    tiles = [(student_id, student_name(token, student_id) if labelled else '', url)
+             for student_id, url in photos]
+    key = collage_key(tiles)
+    file_id = file_ids.get_collage(key)
+    if file_id:
+        try:
+            update.effective_message.reply_photo(photo=file_id, quote=True)
+            return len(tiles)
+        except BadRequest:
+            file_ids.put_collage(key, None)
+    downloaded = [(tile, data) for tile, data in zip(tiles, executor.map(try_download, tiles)) if data]
+    rendered = render_collage(downloaded)
+    if rendered is None:
+        return 0
+    collage, count = rendered
+    message = update.effective_message.reply_photo(photo=collage, quote=True)
+    # A collage missing a photo that failed to download isn't reused.
+    if message.photo and count == len(tiles):
+        file_ids.put_collage(key, message.photo[-1].file_id)
+    return count
+
+
+# Fetches the first photo of each student, yielding (page index, photo) as
+# the fetches complete. The progress message is edited at most every
+# PROGRESS_INTERVAL seconds while they run, failed fetches are counted.
+class PhotoFetch:
+    def __init__(self, token: str, students: List[str], progress: Message):
+        self.total = len(students)
+        self.progress = progress
+        fetch = propagate(fetch_first_photo)
+        self.futures = {executor.submit(fetch, token, student_id): (i, student_id)
+                        for i, student_id in enumerate(students)}
+        self.done = self.sent = self.failed = self.throttled = 0
+        self.reported = monotonic()
+
+    def __iter__(self) -> Iterator[Tuple[int, Photo]]:
+        for future in as_completed(self.futures):
+            index, student_id = self.futures[future]
+            self.done += 1
+            try:
+                photo = future.result()
+            except Throttled:
+                photo = None
+                self.throttled += 1
+            except RequestException as e:
+                logging.warning(f'Failed to fetch photos of {student_id}: {e!r}')
+                photo = None
+                self.failed += 1
+            if photo:
+                yield index, photo
+            self.report()
+
+    def report(self):
+        now = monotonic()
+        if self.done == self.total or now - self.reported < PROGRESS_INTERVAL:
+            return
+        self.reported = now
+        text = f'正在获取 {self.total} 名学生的照片（{self.done} / {self.total}）'
+        if self.sent:
+            text += f'，已发送 {self.sent} 张'
+        self.progress.edit_text(text=text + '...')
+
+
+def all_photos_collage(update: Update, token: str, students: List[str], progress: Message):
+    fetch = PhotoFetch(token, students, progress)
+    # In page order, which also keeps the collage's cache key stable.
+    photos = [photo for _, photo in sorted(fetch)]
+    if not photos and fetch.failed == 0 and fetch.throttled == 0:
+        progress.edit_text(text='本页学生没有相关照片信息')
+        return
+    sent = send_collage(update, token, photos) if photos else 0
+    failed = fetch.failed + len(photos) - sent
+    progress.edit_text(text=result_text(f'{sent} 名学生的照片', failed, fetch.throttled))
 
 
 def all_photos_callback(update: Update, context: CallbackContext,
                         students: List[str]):
     token = context.user_data.get('token', None)
-    photos = []
-    for student_id in students:
-        student_photos = fetch_student_photos(token, student_id)
-        if len(student_photos) > 0:
-            photos.append(student_photos[0])
-    if len(photos) == 0:
-        update.effective_chat.send_chat_action(ChatAction.TYPING)
-        update.effective_message.reply_text(text='本页学生没有相关照片信息',
-                                            quote=True)
+    update.effective_chat.send_chat_action(ChatAction.TYPING)
+    progress = update.effective_message.reply_text(text=f'正在获取 {len(students)} 名学生的照片...',
+                                                   quote=True)
+    if COLLAGE_ENABLED:
+        return all_photos_collage(update, token, students, progress)
+    fetch = PhotoFetch(token, students, progress)
+    pending = []
+    for index, photo in fetch:
+        pending.append((index, photo))
+        if len(pending) == MEDIA_GROUP_SIZE:
+            send_photos(update, [photo for _, photo in sorted(pending)])
+            fetch.sent += len(pending)
+            pending = []
+    if pending:
+        send_photos(update, [photo for _, photo in sorted(pending)])
+        fetch.sent += len(pending)
+    if fetch.sent == 0 and fetch.failed == 0 and fetch.throttled == 0:
+        progress.edit_text(text='本页学生没有相关照片信息')
     else:
-        send_photos(update, photos)
+        progress.edit_text(text=result_text(f'{fetch.sent} 张照片', fetch.failed, fetch.throttled))
@@ -3,9 +3,11 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ParseMo
 from telegram.ext import CallbackContext, CommandHandler, MessageHandler, Filters
 
 from .auth import re_auth_callback
-from ..fetcher import fetch_grade, fetch_class, fetch_student, request_search
-from ..matcher import is_grade_id, is_class_id, is_student_id
+from .bulk import bulk_search
+from ..fetcher import fetch_grade, fetch_class, fetch_student, search_students
+from ..matcher import is_grade_id, is_class_id, is_student_id, match_bulk_ids
 from ..renderer import render_grade, render_class, render_student, render_search
+from ..throttle import THROTTLED_MESSAGE, Throttled
 from ..utils import verify_auth, encode_data, update_or_reply, is_group, send_action
 
 
@@ -14,14 +16,18 @@ def search(update: Update, context: CallbackContext,
     if verify_auth(context.user_data):
         token = context.user_data.get('token')
         try:
-            if is_grade_id(query):
+            if bulk_ids := match_bulk_ids(query):
+                bulk_search(update, context, bulk_ids)
+            elif is_grade_id(query):
                 render_grade(update, context, fetch_grade(token, query))
             elif is_class_id(query):
                 render_class(update, context, fetch_class(token, query), page)
             elif is_student_id(query):
                 render_student(update, context, fetch_student(token, query))
             else:
-                render_search(update, context, request_search(token, query, page), query)
+                render_search(update, context, search_students(token, query, page), query)
+        except Throttled:
+            update_or_reply(update, context, text=THROTTLED_MESSAGE)
         except HTTPError as e:
             if e.response.status_code == 403 or e.response.status_code == 401:
                 update_or_reply(update, context, text='服务器拒绝访问，请重新进行身份认证')
@@ -48,7 +54,7 @@ def search_command(update: Update, context: CallbackContext):
                                            parse_mode=ParseMode.HTML)
 
 
-command_search_handler = CommandHandler('search', search_command, run_async=True)
+command_search_handler = CommandHandler('search', search_command)
 
 
 def message_search(update: Update, context: CallbackContext):
@@ -58,7 +64,7 @@ def message_search(update: Update, context: CallbackContext):
 
 
 message_search_filters = Filters.text & (~(Filters.command | Filters.via_bot(allow_empty=True)))
-message_search_handler = MessageHandler(message_search_filters, message_search, run_async=True)
+message_search_handler = MessageHandler(message_search_filters, message_search)
 
 
 def class_callback(update: Update, context: CallbackContext,
@@ -76,4 +82,4 @@ def student_callback(update: Update, context: CallbackContext,
 def search_callback(update: Update, context: CallbackContext,
                     query: str, page: int = 1):
     token = context.user_data.get('token', None)
-    render_search(update, context, request_search(token, query, page), query)
+    render_search(update, context, search_students(token, query, page), query)
@@ -20,4 +20,4 @@ def start_command(update: Update, context: CallbackContext):
                                                parse_mode=ParseMode.HTML)
 
 
-start_handler = CommandHandler('start', start_command, run_async=True)
+start_handler = CommandHandler('start', start_command)
@@ -0,0 +1,159 @@
+import sys
+from threading import RLock
+from time import monotonic
+from typing import Any, Optional, Tuple, Type
+from weakref import WeakValueDictionary
+
+from scoredb.client import Pagination
+
+from .metrics import Collector
+from .ttl_cache import Shared, budget
+
+# Seconds between recounts of the bytes held by the record pool.
+SWEEP_INTERVAL = 60
+# Evictions recount them at most this often, so a budget kept full by new
+# entries doesn't walk the pool on each of them.
+EVICTION_SWEEP_INTERVAL = 1
+
+
+# Cached ScoreDB models are converted to these slotted records. Records are
+# interned in `pool`, so a roster every user's token fetched is kept in memory
+# once, and each token's cache entry only refers to it.
+class Record(Shared):
+    __slots__ = ('__weakref__',)
+    fields: Tuple[str, ...] = ()
+
+    def __init__(self, *values):
+        for field, value in zip(self.fields, values):
+            setattr(self, field, value)
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.fields)
+
+    def shared_size(self) -> int:
+        return record_size(self, (type(self), self.values()))
+
+    # Unpickled records, e.g. from a cache snapshot, are interned again.
+    def __reduce__(self):
+        return intern_record, (type(self), self.values())
+
+    def __repr__(self):
+        return f'{type(self).__name__}{self.values()!r}'
+
+
+class StudentSummaryRecord(Record):
+    __slots__ = fields = ('id', 'name', 'gender')
+
+
+class StudentRecord(Record):
+    __slots__ = fields = ('id', 'name', 'gender', 'classId', 'birthday', 'eduid')
+
+
+class ClassSummaryRecord(Record):
+    __slots__ = fields = ('id', 'studentsCount')
+
+
+class ClassRecord(Record):
+    __slots__ = fields = ('id', 'studentsCount', 'students')
+
+
+class GradeRecord(Record):
+    __slots__ = fields = ('id', 'classesCount', 'studentsCount', 'classes')
+
+
+def record_size(record: Record, key: tuple) -> int:
+    size = sys.getsizeof(record) + sys.getsizeof(key)
+    for value in record.values():
+        # Nested records are accounted for on their own.
+        if not isinstance(value, Record):
+            size += sys.getsizeof(value)
+    return size
+
+
+# The budget charges records to the cache entries holding them. The pool's own
+# bytes include records only kept alive outside the caches, and as records
+# don't report their release, a finalizer each costing about as much as a
+# record, they are recounted from the live records after evictions and every
+# SWEEP_INTERVAL seconds, and overestimated in between.
+class RecordPool:
+    def __init__(self):
+        self.lock = RLock()
+        self.records: 'WeakValueDictionary[tuple, Record]' = WeakValueDictionary()
+        self.bytes = 0
+        self.hits = 0
+        self.swept = monotonic()
+
+    def intern(self, cls: Type[Record], values: tuple) -> Record:
+        key = (cls, values)
+        with self.lock:
+            record = self.records.get(key)
+            if record is not None:
+                self.hits += 1
+                return record
+            record = cls(*values)
+            self.records[key] = record
+            self.bytes += record_size(record, key)
+        return record
+
+    def sweep(self):
+        with self.lock:
+            self.bytes = sum(record_size(record, key) for key, record in list(self.records.items()))
+            self.swept = monotonic()
+
+    def evicted(self):
+        if monotonic() - self.swept >= EVICTION_SWEEP_INTERVAL:
+            self.sweep()
+
+    def size(self) -> int:
+        if monotonic() - self.swept >= SWEEP_INTERVAL:
+            self.sweep()
+        return self.bytes
+
+
+pool = RecordPool()
+budget.on_evict.append(pool.evicted)
+
+
+def intern_record(cls: Type[Record], values: tuple) -> Record:
+    return pool.intern(cls, values)
+
+
+def _str(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def compact_student_summary(student) -> StudentSummaryRecord:
+    return pool.intern(StudentSummaryRecord, (_str(student.id), _str(student.name), _str(student.gender)))
+
+
+def compact_student(student) -> Optional[StudentRecord]:
+    if student is None:
+        return None
+    return pool.intern(StudentRecord, (_str(student.id), _str(student.name), _str(student.gender),
+                                       _str(student.classId), student.birthday, student.eduid))
+
+
+def compact_class(class_) -> Optional[ClassRecord]:
+    if class_ is None:
+        return None
+    students = tuple(compact_student_summary(student) for student in class_.students or ())
+    return pool.intern(ClassRecord, (_str(class_.id), class_.studentsCount, students))
+
+
+def compact_grade(grade) -> Optional[GradeRecord]:
+    if grade is None:
+        return None
+    classes = tuple(pool.intern(ClassSummaryRecord, (_str(class_.id), class_.studentsCount))
+                    for class_ in grade.classes or ())
+    return pool.intern(GradeRecord, (_str(grade.id), grade.classesCount, grade.studentsCount, classes))
+
+
+def compact_search(pagination: Pagination) -> Pagination:
+    return Pagination(tuple(compact_student_summary(student) for student in pagination.data),
+                      pagination.current_page, pagination.pages)
+
+
+Collector('scoredb_bot_record_pool_bytes', 'Estimated memory used by interned records, held by caches or not',
+          lambda: [({}, pool.size())])
+Collector('scoredb_bot_record_pool_records', 'Number of interned records alive',
+          lambda: [({}, len(pool.records))])
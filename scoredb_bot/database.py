@@ -1,10 +1,185 @@
 import logging
+import pickle
+import sqlite3
+from collections import defaultdict
 from pathlib import Path
+from threading import Event, RLock, Thread
+from typing import Any, Callable, DefaultDict, Dict, Optional, Tuple
 
-from telegram.ext import PicklePersistence
+from telegram.ext import BasePersistence
+
+from .env import env
+
+DATA_DIR = Path(env.str('DATA_DIR', None) or Path(__file__).resolve().parent.parent / 'data')
+
+
+# A defaultdict that reads missing users/chats from the database on first
+# access, so startup doesn't have to load every row.
+class LazyData(defaultdict):
+    def __init__(self, loader: Callable[[int], Optional[dict]]):
+        super().__init__(dict)
+        self.loader = loader
+
+    def __missing__(self, key):
+        value = self.loader(key)
+        if value is None:
+            value = {}
+        self[key] = value
+        return value
+
+    def __copy__(self):
+        copied = LazyData(self.loader)
+        copied.update(self)
+        return copied
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, filename: Path, flush_interval: float = 5):
+        super().__init__(store_user_data=True, store_chat_data=True, store_bot_data=True)
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.lock = RLock()
+        self.connection = sqlite3.connect(str(filename), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS user_data (id INTEGER PRIMARY KEY, data BLOB)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS chat_data (id INTEGER PRIMARY KEY, data BLOB)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, data BLOB)')
+        self.dirty: Dict[Tuple[str, Any], Any] = {}
+        self.written: Dict[Tuple[str, Any], int] = {}
+        self.conversations: Dict[str, dict] = {}
+        self._stop = Event()
+        self._flusher = Thread(target=self._flush_loop, name='persistence-flusher', daemon=True)
+        self._flusher.start()
+
+    def _load(self, table: str, key: Any) -> Optional[Any]:
+        column = 'key' if table == 'kv' else 'id'
+        with self.lock:
+            pending = self.dirty.get((table, key))
+            if pending is not None:
+                return pending
+            row = self.connection.execute(f'SELECT data FROM {table} WHERE {column} = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def _mark(self, table: str, key: Any, data: Any):
+        with self.lock:
+            self.dirty[(table, key)] = data
+
+    def get_user_data(self) -> DefaultDict[int, Dict[Any, Any]]:
+        return LazyData(lambda user_id: self._load('user_data', user_id))
+
+    def get_chat_data(self) -> DefaultDict[int, Dict[Any, Any]]:
+        return LazyData(lambda chat_id: self._load('chat_data', chat_id))
+
+    def get_bot_data(self) -> Dict[Any, Any]:
+        return self._load('kv', 'bot_data') or {}
+
+    def get_conversations(self, name: str) -> Dict:
+        with self.lock:
+            if name not in self.conversations:
+                self.conversations[name] = self._load('kv', f'conversations:{name}') or {}
+            return self.conversations[name].copy()
+
+    def update_user_data(self, user_id: int, data: Dict) -> None:
+        self._mark('user_data', user_id, data)
+
+    def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        self._mark('chat_data', chat_id, data)
+
+    def update_bot_data(self, data: Dict) -> None:
+        self._mark('kv', 'bot_data', data)
+
+    def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        with self.lock:
+            conversations = self.conversations.setdefault(name, {})
+            if new_state is None:
+                conversations.pop(key, None)
+            else:
+                conversations[key] = new_state
+            self._mark('kv', f'conversations:{name}', conversations.copy())
+
+    # A row that can't be pickled is logged and left out, without holding
+    # back the others.
+    def write(self, rows: Dict[Tuple[str, Any], Any]):
+        changed = []
+        for (table, key), data in rows.items():
+            try:
+                blob = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                logging.error(f'Failed to pickle {table} {key}, not persisting it: {e!r}')
+                continue
+            if self.written.get((table, key)) != hash(blob):
+                changed.append((table, key, blob))
+        if not changed:
+            return
+        with self.lock:
+            with self.connection:
+                for table, key, blob in changed:
+                    column = 'key' if table == 'kv' else 'id'
+                    self.connection.execute(f'INSERT OR REPLACE INTO {table} ({column}, data) VALUES (?, ?)',
+                                            (key, blob))
+            # Only once committed, a rolled back row must be written again.
+            for table, key, blob in changed:
+                self.written[(table, key)] = hash(blob)
+        logging.debug(f'Persisted {len(changed)} changed entries')
+
+    def flush(self) -> None:
+        with self.lock:
+            rows, self.dirty = self.dirty, {}
+            try:
+                self.write(rows)
+            except Exception:
+                # Kept for the next flush, unless marked again since.
+                for row, data in rows.items():
+                    self.dirty.setdefault(row, data)
+                raise
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f'Failed to flush persistence: {e!r}')
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+        self.connection.close()
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            for table in ('user_data', 'chat_data', 'kv'):
+                if self.connection.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone():
+                    return False
+        return True
+
+    def migrate_pickle(self, pickle_file: Path):
+        if not pickle_file.exists() or not self.is_empty():
+            return
+        logging.info(f'Migrating persistence from "{pickle_file}"')
+        with pickle_file.open('rb') as f:
+            data = pickle.load(f)
+        rows = {}
+        for user_id, user_data in (data.get('user_data') or {}).items():
+            rows[('user_data', user_id)] = user_data
+        for chat_id, chat_data in (data.get('chat_data') or {}).items():
+            rows[('chat_data', chat_id)] = chat_data
+        if data.get('bot_data'):
+            rows[('kv', 'bot_data')] = data['bot_data']
+        for name, conversations in (data.get('conversations') or {}).items():
+            rows[('kv', f'conversations:{name}')] = conversations
+        self.write(rows)
+        pickle_file.rename(pickle_file.with_name(pickle_file.name + '.migrated'))
+        logging.info(f'Migrated {len(rows)} entries')
 
 
 def get_persistence():
-    persistence_file = Path(__file__).resolve().parent.parent / 'data/persistence.db'
+    persistence_file = DATA_DIR / 'persistence.sqlite3'
     logging.info(f'Using persistence at "{persistence_file}"')
-    return PicklePersistence(persistence_file)
+    persistence = SQLitePersistence(persistence_file,
+                                    flush_interval=env.float('PERSISTENCE_FLUSH_INTERVAL', 5))
+    persistence.migrate_pickle(DATA_DIR / 'persistence.db')
+    return persistence
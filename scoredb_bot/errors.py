@@ -0,0 +1,105 @@
+from collections import deque
+from hashlib import sha1
+from threading import Lock
+from time import time
+from traceback import extract_tb
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from .env import env
+from .metrics import Collector
+
+ERROR_DIGEST_INTERVAL = env.int('ERROR_DIGEST_INTERVAL', 5 * 60)
+# A fingerprint not seen for this long is reported right away again.
+ERROR_QUIET_PERIOD = env.int('ERROR_QUIET_PERIOD', 60 * 60)
+
+
+# Exceptions of the same type raised from the same stack share a fingerprint.
+# Line numbers are left out so a deploy doesn't change every fingerprint.
+def fingerprint(error: BaseException) -> str:
+    frames = [(frame.filename.rsplit('/', 1)[-1], frame.name) for frame in extract_tb(error.__traceback__)]
+    return sha1(repr((type(error).__qualname__, frames)).encode()).hexdigest()[:8]
+
+
+class ErrorStats:
+    __slots__ = ('fingerprint', 'name', 'message', 'last_seen', 'total', 'users',
+                 'pending', 'pending_users')
+
+    def __init__(self, fingerprint: str, error: BaseException):
+        self.fingerprint = fingerprint
+        self.name = type(error).__name__
+        self.message = str(error)[:200]
+        self.last_seen = 0.0
+        self.total = 0
+        self.users: Set[int] = set()
+        # Repeats since the last report.
+        self.pending = 0
+        self.pending_users: Set[int] = set()
+
+
+# (time, fingerprint, user id, formatted traceback)
+Trace = Tuple[float, str, Optional[int], str]
+
+
+class ErrorAggregator:
+    def __init__(self, buffer_size: int, quiet_period: float):
+        self.quiet_period = quiet_period
+        self.lock = Lock()
+        self.stats: Dict[str, ErrorStats] = {}
+        self.traces: Deque[Trace] = deque(maxlen=buffer_size)
+        self.reported = 0
+        self.suppressed = 0
+
+    # Returns the error's stats and whether it should be reported right away.
+    def record(self, error: BaseException, user_id: Optional[int], trace: str) -> Tuple[ErrorStats, bool]:
+        key = fingerprint(error)
+        now = time()
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = ErrorStats(key, error)
+            report = now - stats.last_seen > self.quiet_period
+            stats.total += 1
+            stats.last_seen = now
+            if user_id is not None:
+                stats.users.add(user_id)
+            if report:
+                self.reported += 1
+            else:
+                self.suppressed += 1
+                stats.pending += 1
+                if user_id is not None:
+                    stats.pending_users.add(user_id)
+            self.traces.append((now, key, user_id, trace))
+        return stats, report
+
+    # Returns the errors repeated since the last digest, with their repeat and
+    # affected user counts, and starts counting again.
+    def drain(self) -> List[Tuple[ErrorStats, int, int]]:
+        with self.lock:
+            result = []
+            for stats in self.stats.values():
+                if stats.pending:
+                    result.append((stats, stats.pending, len(stats.pending_users)))
+                    stats.pending = 0
+                    stats.pending_users = set()
+        result.sort(key=lambda item: item[1], reverse=True)
+        return result
+
+    def recent(self, key: Optional[str] = None) -> Optional[Trace]:
+        with self.lock:
+            for trace in reversed(self.traces):
+                if key is None or trace[1] == key:
+                    return trace
+        return None
+
+    def top(self, limit: int = 10) -> List[ErrorStats]:
+        with self.lock:
+            return sorted(self.stats.values(), key=lambda stats: stats.total, reverse=True)[:limit]
+
+
+aggregator = ErrorAggregator(buffer_size=env.int('ERROR_TRACE_BUFFER', 100),
+                             quiet_period=ERROR_QUIET_PERIOD)
+
+Collector('scoredb_bot_errors_total', 'Handler errors, by whether they were reported right away',
+          lambda: [({'report': 'immediate'}, aggregator.reported),
+                   ({'report': 'digest'}, aggregator.suppressed)], 'counter')
@@ -1,52 +1,165 @@
+from contextlib import contextmanager
 from functools import lru_cache
+from math import ceil
+from time import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 from requests import HTTPError
-from scoredb import Client
+from scoredb.client import Pagination
 
+from .compact import compact_class, compact_grade, compact_search, compact_student
+from .env import env
+from .metrics import observe_upstream
+from .throttle import limiter
+from .tracing import span
+from .transport import create_client
+from .ttl_cache import ttl_cache
 
-@lru_cache(maxsize=None)
+NEGATIVE_TTL = env.int('CACHE_NEGATIVE_TTL', 60)
+STALE_TTL = env.int('CACHE_STALE_TTL', 60 * 60)
+WARMUP_TOKEN = env.str('WARMUP_TOKEN', None)
+AUTHORIZED_TTL = env.int('AUTHORIZED_TTL', 2 * 60 * 60)
+SEARCH_WINDOW = env.int('SEARCH_WINDOW_PAGES', 5)
+
+# (token, kind, id) of a roster -> when ScoreDB last returned it to the token.
+# A valid token isn't allowed to read every roster, so a grant only covers the
+# roster it was given for.
+authorized: Dict[Tuple[str, str, str], float] = {}
+
+
+@lru_cache(maxsize=env.int('CLIENT_CACHE_SIZE', 256))
 def get_client(token: str):
-    return Client(token)
+    return create_client(token)
+
+
+@contextmanager
+def upstream(name: str, token: str, resource: Optional[Tuple[str, str]] = None):
+    with span(f'upstream.{name}'):
+        limiter.acquire(token)
+        with observe_upstream(name):
+            yield
+    if resource is not None:
+        grant(token, *resource)
+
+
+def grant(token: str, kind: str, id_: str):
+    now = time()
+    if len(authorized) >= 10000:
+        for key, granted in list(authorized.items()):
+            if now - granted >= AUTHORIZED_TTL:
+                del authorized[key]
+    authorized[(token, kind, id_)] = now
+
+
+def is_authorized(token: str, kind: str, id_: str) -> bool:
+    return time() - authorized.get((token, kind, id_), 0) < AUTHORIZED_TTL
+
+
+# Grants are kept in the cache snapshot, so returning users are served warmed
+# rosters right after a restart.
+def live_grants() -> List[Tuple[Tuple[str, str, str], float]]:
+    now = time()
+    return [(key, granted) for key, granted in list(authorized.items()) if now - granted < AUTHORIZED_TTL]
 
 
-@lru_cache(maxsize=64)
+def restore_grants(grants: Iterable[Tuple[Tuple[str, str, str], float]]) -> int:
+    now = time()
+    restored = 0
+    for key, granted in grants:
+        if now - granted < AUTHORIZED_TTL and granted > authorized.get(key, 0):
+            authorized[key] = granted
+            restored += 1
+    return restored
+
+
+# A roster warmed up with the service token is served to another token only
+# if ScoreDB has recently returned that same roster to it, instead of fetching
+# it again once the token's own entry expires.
+def from_warm_roster(fetch: Callable, kind: str, token: str, id_: str):
+    if WARMUP_TOKEN and token and token != WARMUP_TOKEN and is_authorized(token, kind, id_):
+        return fetch.peek(WARMUP_TOKEN, id_)
+    return None
+
+
+@ttl_cache('grade', ttl=env.int('CACHE_GRADE_TTL', 60 * 60),
+           negative_ttl=NEGATIVE_TTL, stale_ttl=STALE_TTL)
 def fetch_grade(token: str, grade_id: str):
+    grade = from_warm_roster(fetch_grade, 'grade', token, grade_id)
+    if grade is not None:
+        return grade
     try:
-        return get_client(token).studentdb.get_grade_details(grade_id)
+        with upstream('fetch_grade', token, ('grade', grade_id)):
+            return compact_grade(get_client(token).studentdb.get_grade_details(grade_id))
     except HTTPError as e:
         if e.response.status_code == 404:
             return None
         raise
 
 
-@lru_cache(maxsize=64)
+@ttl_cache('class', ttl=env.int('CACHE_CLASS_TTL', 30 * 60),
+           negative_ttl=NEGATIVE_TTL, stale_ttl=STALE_TTL)
 def fetch_class(token: str, class_id: str):
+    class_ = from_warm_roster(fetch_class, 'class', token, class_id)
+    if class_ is not None:
+        return class_
     try:
-        return get_client(token).studentdb.get_class_details(class_id)
+        with upstream('fetch_class', token, ('class', class_id)):
+            return compact_class(get_client(token).studentdb.get_class_details(class_id))
     except HTTPError as e:
         if e.response.status_code == 404:
             return None
         raise
 
 
-@lru_cache(maxsize=256)
+@ttl_cache('student', ttl=env.int('CACHE_STUDENT_TTL', 30 * 60),
+           negative_ttl=NEGATIVE_TTL, stale_ttl=STALE_TTL)
 def fetch_student(token: str, student_id: str):
     try:
-        return get_client(token).studentdb.get_student_details(student_id)
+        with upstream('fetch_student', token):
+            return compact_student(get_client(token).studentdb.get_student_details(student_id))
     except HTTPError as e:
         if e.response.status_code == 404:
             return None
         raise
 
 
-@lru_cache(maxsize=128)
+@ttl_cache('student_photos', ttl=env.int('CACHE_PHOTOS_TTL', 6 * 60 * 60),
+           negative_ttl=NEGATIVE_TTL, stale_ttl=STALE_TTL)
 def fetch_student_photos(token: str, student_id: str):
-    photos = get_client(token).studentdb.get_student_photos(student_id)
+    with upstream('fetch_student_photos', token):
+        photos = get_client(token).studentdb.get_student_photos(student_id)
     if not photos:
         photos = []
     return photos
 
 
-@lru_cache(maxsize=64)
+@ttl_cache('search', ttl=env.int('CACHE_SEARCH_TTL', 5 * 60),
+           negative_ttl=NEGATIVE_TTL)
 def request_search(token: str, query: str, page: int = 1, page_size: int = 9):
-    return get_client(token).studentdb.search_student(query, page, page_size)
+    with upstream('request_search', token):
+        return compact_search(get_client(token).studentdb.search_student(query, page, page_size))
+
+
+# A page cut out of a search window. Until the last window has been fetched
+# the number of pages isn't known, `pages` is then only a lower bound.
+class SearchPage(Pagination):
+    def __init__(self, data, current_page: int, pages: int, exact: bool):
+        super().__init__(data, current_page, pages)
+        self.exact = exact
+
+
+# Searches fetch SEARCH_WINDOW pages in one request and cache them as one
+# result, page turns within the window are served from it.
+def search_window(token: str, query: str, page: int, page_size: int = 9):
+    return request_search(token, query, (page - 1) // SEARCH_WINDOW + 1, page_size * SEARCH_WINDOW)
+
+
+def search_students(token: str, query: str, page: int = 1, page_size: int = 9) -> SearchPage:
+    page = max(page, 1)
+    window = search_window(token, query, page, page_size)
+    pages_before = (page - 1) // SEARCH_WINDOW * SEARCH_WINDOW
+    offset = (page - 1 - pages_before) * page_size
+    data = window.data[offset:offset + page_size]
+    if window.has_next_page():
+        return SearchPage(data, page, pages_before + SEARCH_WINDOW + 1, exact=False)
+    return SearchPage(data, page, pages_before + ceil(len(window.data) / page_size), exact=True)
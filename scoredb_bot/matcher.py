@@ -1,4 +1,5 @@
 import re
+from typing import List, Optional, Tuple
 
 
 def _match(pattern: str, subject: str):
@@ -23,3 +24,29 @@ def is_class_id(subject: str):
 
 def is_student_id(subject: str):
     return _match(r'(^[xXcCgG][0-9]{6}$)|(^[0-9]{8}$)$', subject)
+
+
+ID_PATTERN = re.compile(r'(?<![0-9A-Za-z])'
+                        r'(?:(?P<student>[xXcCgG][0-9]{6}|[0-9]{8})'
+                        r'|(?P<class>[xXcCgG][0-9]{4})'
+                        r'|(?P<grade>[xXcCgG][0-9]{2}))'
+                        r'(?![0-9A-Za-z])')
+SEPARATOR_PATTERN = re.compile(r'^[\s,，;；、|/]*$')
+
+
+def tokenize_ids(subject: str) -> List[Tuple[str, str]]:
+    ids = []
+    seen = set()
+    for match in ID_PATTERN.finditer(subject):
+        item = (match.lastgroup, match.group())
+        if item not in seen:
+            seen.add(item)
+            ids.append(item)
+    return ids
+
+
+def match_bulk_ids(subject: str) -> Optional[List[Tuple[str, str]]]:
+    ids = tokenize_ids(subject)
+    if len(ids) < 2 or not SEPARATOR_PATTERN.match(ID_PATTERN.sub('', subject)):
+        return None
+    return ids
@@ -0,0 +1,177 @@
+import logging
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Sample = Tuple[Dict[str, str], float]
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+class Metric(ABC):
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = Lock()
+        registry.append(self)
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        pass
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                # One count per bucket plus +Inf, then the sum.
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, *label_values)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = [(k, list(v)) for k, v in self.values.items()]
+        lines = self.header()
+        for label_values, counts in values:
+            labels = dict(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels({**labels, "le": bound})} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(labels)} {counts[-1]}')
+            lines.append(f'{self.name}_count{_labels(labels)} {cumulative}')
+        return lines
+
+
+# Values read from their owner when the endpoint is scraped.
+class Collector(Metric):
+    def __init__(self, name: str, help: str, collect: Callable[[], Iterable[Sample]],
+                 type: str = 'gauge'):
+        super().__init__(name, help)
+        self.collect = collect
+        self.type = type
+
+    def render(self) -> List[str]:
+        try:
+            samples = list(self.collect())
+        except Exception as e:
+            logging.warning(f'Failed to collect {self.name}: {e!r}')
+            return []
+        return self.header() + [f'{self.name}{_labels(labels)} {value}' for labels, value in samples]
+
+
+registry: List[Metric] = []
+
+
+def render() -> str:
+    lines = []
+    for metric in list(registry):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+handler_latency = Histogram('scoredb_bot_handler_seconds', 'Time spent running update handlers', ['handler'])
+callback_latency = Histogram('scoredb_bot_callback_seconds', 'Time spent running callback query handlers', ['type'])
+upstream_latency = Histogram('scoredb_bot_upstream_seconds', 'Latency of ScoreDB requests', ['function', 'status'])
+
+_in_progress = 0
+_in_progress_lock = Lock()
+
+
+def handlers_in_progress() -> int:
+    return _in_progress
+
+
+def instrument_handler(name: str, func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        global _in_progress
+        with _in_progress_lock:
+            _in_progress += 1
+        try:
+            with handler_latency.time(name):
+                return func(*args, **kwargs)
+        finally:
+            with _in_progress_lock:
+                _in_progress -= 1
+
+    return wrapper
+
+
+@contextmanager
+def observe_upstream(name: str):
+    started = perf_counter()
+    status = '200'
+    try:
+        yield
+    except Exception as e:
+        response = getattr(e, 'response', None)
+        status = str(response.status_code) if response is not None else type(e).__name__
+        raise
+    finally:
+        upstream_latency.observe(perf_counter() - started, name, status)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(listen: str, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((listen, port), MetricsHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f'Serving metrics on http://{listen}:{port}/metrics')
+    return server
@@ -0,0 +1,70 @@
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .database import DATA_DIR
+
+
+# Telegram file_ids of student photos, and of collages made from them, that we
+# have already uploaded, so they can be sent again without another download
+# or upload.
+class FileIdStore:
+    def __init__(self, filename: Path):
+        self.lock = Lock()
+        self.connection = sqlite3.connect(str(filename), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS file_ids '
+                                    '(student_id TEXT, url TEXT, file_id TEXT, '
+                                    'PRIMARY KEY (student_id, url))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS collages (key TEXT PRIMARY KEY, file_id TEXT)')
+
+    def get(self, photos: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+        photos = list(photos)
+        result = {}
+        with self.lock:
+            for student_id, url in photos:
+                row = self.connection.execute('SELECT file_id FROM file_ids WHERE student_id = ? AND url = ?',
+                                              (student_id, url)).fetchone()
+                if row is not None:
+                    result[(student_id, url)] = row[0]
+        return result
+
+    def put(self, photos: Dict[Tuple[str, str], str]):
+        if not photos:
+            return
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO file_ids (student_id, url, file_id) '
+                                        'VALUES (?, ?, ?)',
+                                        [(s, u, f) for (s, u), f in photos.items()])
+
+    def forget(self, photos: Iterable[Tuple[str, str]]):
+        with self.lock, self.connection:
+            self.connection.executemany('DELETE FROM file_ids WHERE student_id = ? AND url = ?', list(photos))
+
+    # Drops the file_ids of photos ScoreDB no longer lists for the student.
+    def sync(self, student_id: str, urls: List[str]):
+        with self.lock:
+            rows = self.connection.execute('SELECT url FROM file_ids WHERE student_id = ?',
+                                           (student_id,)).fetchall()
+        stale = [(student_id, url) for url, in rows if url not in urls]
+        if stale:
+            self.forget(stale)
+
+    def get_collage(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.connection.execute('SELECT file_id FROM collages WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_collage(self, key: str, file_id: Optional[str]):
+        with self.lock, self.connection:
+            if file_id is None:
+                self.connection.execute('DELETE FROM collages WHERE key = ?', (key,))
+            else:
+                self.connection.execute('INSERT OR REPLACE INTO collages (key, file_id) VALUES (?, ?)',
+                                        (key, file_id))
+
+
+store = FileIdStore(DATA_DIR / 'photos.sqlite3')
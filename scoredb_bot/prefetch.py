@@ -0,0 +1,117 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Deque, Dict, Iterable, Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from .env import env
+from .fetcher import fetch_student, fetch_student_photos, search_students, search_window
+from .throttle import background
+
+PREFETCH_ENABLED = env.bool('PREFETCH_ENABLED', True)
+PREFETCH_PHOTOS = env.bool('PREFETCH_PHOTOS', False)
+
+
+# Jobs are queued per token and at most `per_token` of them run at once, so a
+# busy user never bursts into ScoreDB's rate limit. Starting a new round for an
+# owner (a user navigating to another page) cancels everything still queued
+# for the previous one.
+class Prefetcher:
+    def __init__(self, workers: int, per_token: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self.per_token = per_token
+        self.lock = Lock()
+        self.generations: Dict[int, int] = {}
+        self.queues: Dict[str, Deque[tuple]] = {}
+        self.active: Dict[str, int] = {}
+
+    def start(self, owner: int) -> int:
+        with self.lock:
+            generation = self.generations.get(owner, 0) + 1
+            self.generations[owner] = generation
+            for queue in self.queues.values():
+                stale = [job for job in queue if job[0] == owner]
+                for job in stale:
+                    queue.remove(job)
+            return generation
+
+    def is_current(self, owner: int, generation: int) -> bool:
+        return self.generations.get(owner) == generation
+
+    def submit(self, owner: int, generation: int, token: str, func: Callable, *args):
+        with self.lock:
+            if not self.is_current(owner, generation):
+                return
+            self.queues.setdefault(token, deque()).append((owner, generation, func, args))
+        self._pump(token)
+
+    def _pump(self, token: str):
+        with self.lock:
+            queue = self.queues.get(token)
+            while queue and self.active.get(token, 0) < self.per_token:
+                job = queue.popleft()
+                self.active[token] = self.active.get(token, 0) + 1
+                self.executor.submit(self._run, token, *job)
+            if queue is not None and not queue:
+                del self.queues[token]
+
+    def _run(self, token: str, owner: int, generation: int, func: Callable, args: tuple):
+        try:
+            # Prefetches only spend the part of the token's rate limit the
+            # requests the user is actually waiting for don't need.
+            with background():
+                if self.is_current(owner, generation):
+                    func(token, *args)
+        except Exception as e:
+            logging.debug(f'Prefetch {func.__name__}{args} failed: {e!r}')
+        finally:
+            with self.lock:
+                self.active[token] -= 1
+                if self.active[token] == 0:
+                    del self.active[token]
+            self._pump(token)
+
+
+prefetcher = Prefetcher(workers=env.int('PREFETCH_WORKERS', 4),
+                        per_token=env.int('PREFETCH_PER_TOKEN', 2))
+
+
+def _owner(update: Update) -> Optional[int]:
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+def warm_student(token: str, student_id: str):
+    if not fetch_student.is_cached(token, student_id):
+        fetch_student(token, student_id)
+    if PREFETCH_PHOTOS and not fetch_student_photos.is_cached(token, student_id):
+        fetch_student_photos(token, student_id)
+
+
+def warm_search(token: str, query: str, page: int, owner: int, generation: int):
+    pagination = search_students(token, query, page)
+    for student in pagination.data:
+        prefetcher.submit(owner, generation, token, warm_student, student.id)
+    # Loads the next window while the user is still on the last pages of this one.
+    if pagination.has_next_page():
+        search_window(token, query, page + 1)
+
+
+def prefetch_students(update: Update, context: CallbackContext,
+                      students: Iterable[str],
+                      next_search: Optional[tuple] = None):
+    token = context.user_data.get('token', None)
+    owner = _owner(update)
+    if not PREFETCH_ENABLED or not token or owner is None:
+        return
+    generation = prefetcher.start(owner)
+    for student_id in students:
+        prefetcher.submit(owner, generation, token, warm_student, student_id)
+    if next_search:
+        prefetcher.submit(owner, generation, token, warm_search, *next_search, owner, generation)
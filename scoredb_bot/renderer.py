@@ -7,9 +7,14 @@ from scoredb.models import Grade, Class, StudentSummary, Student
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
 from telegram.ext import CallbackContext
 
+from .prefetch import prefetch_students
+from .tracing import traced
 from .utils import update_or_reply, gender_emoji, encode_data
 
+PAGE_SIZE = 9
 
+
+@traced('render.grade')
 def render_grade(update: Update, context: CallbackContext,
                  grade: Optional[Grade]):
     if not grade:
@@ -23,20 +28,26 @@ def render_grade(update: Update, context: CallbackContext,
                     parse_mode=ParseMode.HTML)
 
 
+@traced('render.class')
 def render_class(update: Update, context: CallbackContext,
                  class_: Optional[Class], page: int = 1):
     if not class_:
         return update_or_reply(update, context, text='未找到匹配的班级')
     message = f'🧑‍🏫 <strong>{class_.id} 班</strong>\n\n'
     message += f'此班级共有 {class_.studentsCount} 名学生：\n'
-    kwargs = render_students_pagination(class_.students, message, {
+    pagination = create_pagination(class_.students, page)
+    kwargs = render_students_pagination(pagination, message, {
         'event_type': 'class',
         'class_id': class_.id,
         'page': page
     })
     update_or_reply(update, context, **kwargs)
+    start = max(pagination.current_page - 1, 0) * PAGE_SIZE
+    prefetch_students(update, context,
+                      [student.id for student in class_.students[start:start + 2 * PAGE_SIZE]])
 
 
+@traced('render.student')
 def render_student(update: Update, context: CallbackContext,
                    student: Optional[Student],
                    from_page: Optional[dict] = None):
@@ -65,6 +76,7 @@ def render_student(update: Update, context: CallbackContext,
                     parse_mode=ParseMode.HTML)
 
 
+@traced('render.search')
 def render_search(update: Update, context: CallbackContext,
                   pagination: Pagination[StudentSummary],
                   query: str):
@@ -78,6 +90,26 @@ def render_search(update: Update, context: CallbackContext,
             'page': pagination.current_page
         })
         update_or_reply(update, context, **kwargs)
+        next_search = (query, pagination.current_page + 1) if pagination.has_next_page() else None
+        prefetch_students(update, context,
+                          [student.id for student in pagination.data],
+                          next_search)
+
+
+def create_pagination(students: List[StudentSummary], current_page: int) -> Pagination[StudentSummary]:
+    count_all = len(students)
+    pages = ceil(count_all / PAGE_SIZE)
+    size = PAGE_SIZE
+    if current_page < 1:
+        current_page = 1
+    if current_page > pages:
+        current_page = pages
+    start = (current_page - 1) * size
+    end = current_page * size
+    if end > count_all:
+        end = count_all
+    data = students[start:end]
+    return Pagination(data, current_page, pages)
 
 
 def render_students_pagination(pagination: Union[Pagination[StudentSummary], List[StudentSummary]],
@@ -85,25 +117,11 @@ def render_students_pagination(pagination: Union[Pagination[StudentSummary], Lis
                                page_ref: dict):
     message = prepend_message
 
-    def create_pagination(students: List[StudentSummary], current_page: int) -> Pagination[StudentSummary]:
-        count_all = len(students)
-        pages = ceil(count_all / 9)
-        size = 9
-        if current_page < 1:
-            current_page = 1
-        if current_page > pages:
-            current_page = pages
-        start = (current_page - 1) * size
-        end = current_page * size
-        if end > count_all:
-            end = count_all
-        data = students[start:end]
-        return Pagination(data, current_page, pages)
-
-    if type(pagination) != Pagination:
+    if not isinstance(pagination, Pagination):
         pagination = create_pagination(pagination, page_ref.get('page', 1))
 
-    message += f'正在显示第 {pagination.current_page} / {pagination.pages} 页：\n'
+    pages = pagination.pages if getattr(pagination, 'exact', True) else f'{pagination.pages}+'
+    message += f'正在显示第 {pagination.current_page} / {pages} 页：\n'
     for i, student in enumerate(pagination.data):
         message += f'{i + 1}. ' \
                    f'<strong>{student.id}</strong> ' \
@@ -0,0 +1,262 @@
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from math import inf
+from threading import Condition, Thread, local
+from time import monotonic
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+from .cluster import WORKER_PROCESSES
+from .env import env
+from .metrics import Collector
+from .tracing import span
+
+INTERACTIVE = 0
+MEDIA = 1
+REPORT = 2
+
+MEDIA_ENDPOINTS = {'sendMediaGroup', 'sendPhoto', 'sendDocument'}
+EDIT_ENDPOINTS = {'editMessageText', 'editMessageReplyMarkup'}
+# Chat actions and deletions don't count as messages, so they only spend the
+# global budget.
+FREE_ENDPOINTS = {'sendChatAction', 'deleteMessage'}
+
+MAX_RETRIES = 3
+
+_local = local()
+
+
+@contextmanager
+def send_lane(lane: int):
+    previous = getattr(_local, 'lane', None)
+    _local.lane = lane
+    try:
+        yield
+    finally:
+        _local.lane = previous
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # A cost above the capacity waits for a full bucket and leaves it in debt,
+    # later sends then wait until it is paid off.
+    def delay(self, now: float, cost: int = 1) -> float:
+        self._refill(now)
+        needed = min(cost, self.capacity)
+        return 0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def take(self, now: float, cost: int = 1):
+        self._refill(now)
+        self.tokens -= cost
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class Job:
+    __slots__ = ('post', 'endpoint', 'data', 'args', 'kwargs', 'chat_id', 'lane', 'edit_key',
+                 'cost', 'retries', 'future')
+
+    def __init__(self, post: Callable, endpoint: str, data: dict, args: tuple, kwargs: dict,
+                 chat_id, lane: int, edit_key: Optional[Hashable]):
+        self.post = post
+        self.endpoint = endpoint
+        self.data = data
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.lane = lane
+        self.edit_key = edit_key
+        # Telegram counts each item of an album as a message.
+        self.cost = (len(data.get('media') or ()) or 1) if endpoint == 'sendMediaGroup' else 1
+        self.retries = 0
+        self.future = Future()
+
+
+# Sends are released by priority lane as long as both the global bucket and
+# the chat's bucket have a token for each message they send, and are then run
+# on a small thread pool. A send waiting for its chat holds back the chat's
+# later sends, and one waiting for the global bucket holds back every send,
+# so an album isn't overtaken forever by single messages.
+# A queued edit of a message absorbs any later edit of the same message.
+class SendScheduler:
+    def __init__(self, global_rate: float, private_rate: float, group_rate: float,
+                 chat_burst: float, group_burst: float, workers: int):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.group_burst = group_burst
+        self.lanes: List[Deque[Job]] = [deque() for _ in (INTERACTIVE, MEDIA, REPORT)]
+        self.chat_buckets: Dict[Any, TokenBucket] = {}
+        self.blocked_until: Dict[Any, float] = {}
+        self.edits: Dict[Hashable, Job] = {}
+        self.condition = Condition()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sender')
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.thread = Thread(target=self._loop, name='send-scheduler', daemon=True)
+        self.thread.start()
+
+    def queue_depth(self) -> List[int]:
+        with self.condition:
+            return [len(lane) for lane in self.lanes]
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            try:
+                is_group = int(chat_id) < 0
+            except ValueError:
+                is_group = True
+            if is_group:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def submit(self, post: Callable, endpoint: str, data: dict, args: tuple, kwargs: dict) -> Future:
+        chat_id = data.get('chat_id')
+        lane = getattr(_local, 'lane', None)
+        if lane is None:
+            lane = MEDIA if endpoint in MEDIA_ENDPOINTS else INTERACTIVE
+        edit_key = None
+        if endpoint in EDIT_ENDPOINTS and data.get('message_id') is not None:
+            edit_key = (endpoint, chat_id, data['message_id'])
+        with self.condition:
+            pending = self.edits.get(edit_key) if edit_key else None
+            if pending is not None:
+                pending.data = data
+                self.coalesced += 1
+                return pending.future
+            job = Job(post, endpoint, data, args, kwargs, chat_id, lane, edit_key)
+            if edit_key:
+                self.edits[edit_key] = job
+            self.lanes[lane].append(job)
+            self.condition.notify()
+        return job.future
+
+    def _delay(self, job: Job, now: float) -> float:
+        delay = self.blocked_until.get(job.chat_id, 0) - now
+        if job.endpoint not in FREE_ENDPOINTS:
+            delay = max(delay, self._chat_bucket(job.chat_id).delay(now, job.cost))
+        return delay
+
+    def _pick(self, now: float) -> Tuple[Optional[Job], float]:
+        wait = self.global_bucket.delay(now)
+        if wait > 0:
+            return None, wait
+        wait = inf
+        waiting_chats = set()
+        for lane in self.lanes:
+            for job in lane:
+                counted = job.endpoint not in FREE_ENDPOINTS
+                if counted and job.chat_id in waiting_chats:
+                    continue
+                delay = self._delay(job, now)
+                if delay > 0:
+                    if counted:
+                        waiting_chats.add(job.chat_id)
+                    wait = min(wait, delay)
+                    continue
+                delay = self.global_bucket.delay(now, job.cost)
+                if delay > 0:
+                    return None, delay
+                lane.remove(job)
+                return job, 0
+        return None, wait
+
+    def _prune(self, now: float):
+        for chat_id in [c for c, b in self.chat_buckets.items() if b.is_full(now)]:
+            del self.chat_buckets[chat_id]
+        for chat_id in [c for c, t in self.blocked_until.items() if t <= now]:
+            del self.blocked_until[chat_id]
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                while True:
+                    now = monotonic()
+                    job, wait = self._pick(now)
+                    if job is not None:
+                        break
+                    self.condition.wait(None if wait == inf else wait)
+                self.global_bucket.take(now, job.cost)
+                if job.endpoint not in FREE_ENDPOINTS:
+                    self._chat_bucket(job.chat_id).take(now, job.cost)
+                if job.edit_key:
+                    self.edits.pop(job.edit_key, None)
+                self.sent += 1
+                if len(self.chat_buckets) > 10000:
+                    self._prune(now)
+            self.executor.submit(self._run, job)
+
+    def _run(self, job: Job):
+        try:
+            result = job.post(job.endpoint, job.data, job.args, job.kwargs)
+        except RetryAfter as e:
+            with self.condition:
+                self.blocked_until[job.chat_id] = monotonic() + e.retry_after
+                if job.retries < MAX_RETRIES:
+                    logging.warning(f'Flood limit hit in chat {job.chat_id}, retrying in {e.retry_after}s')
+                    job.retries += 1
+                    self.retried += 1
+                    if job.edit_key and job.edit_key not in self.edits:
+                        self.edits[job.edit_key] = job
+                    self.lanes[job.lane].appendleft(job)
+                    self.condition.notify()
+                    return
+            job.future.set_exception(e)
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+
+
+# Worker processes each get an equal share of the bot's global rate. Updates
+# are sharded by user, so a group's members can be spread over every worker,
+# and each worker also gets a share of every group's rate and burst.
+scheduler = SendScheduler(global_rate=env.float('SEND_GLOBAL_RATE', 30) / max(WORKER_PROCESSES, 1),
+                          private_rate=env.float('SEND_PRIVATE_RATE', 1),
+                          group_rate=env.float('SEND_GROUP_RATE', 20 / 60) / max(WORKER_PROCESSES, 1),
+                          chat_burst=env.float('SEND_CHAT_BURST', 3),
+                          group_burst=max(env.float('SEND_CHAT_BURST', 3) / max(WORKER_PROCESSES, 1), 1),
+                          workers=env.int('SEND_WORKERS', 8))
+
+
+class ScheduledBot(ExtBot):
+    # The span includes the time a send waited for the scheduler.
+    def _post(self, endpoint: str, data: dict = None, *args, **kwargs):
+        with span(f'send.{endpoint}'):
+            if data is None or 'chat_id' not in data:
+                return super()._post(endpoint, data, *args, **kwargs)
+            return scheduler.submit(self._post_now, endpoint, data, args, kwargs).result()
+
+    def _post_now(self, endpoint: str, data: dict, args: tuple, kwargs: dict):
+        return super()._post(endpoint, data, *args, **kwargs)
+
+
+Collector('scoredb_bot_send_queue_depth', 'Bot API sends waiting in the scheduler',
+          lambda: [({'lane': lane}, depth)
+                   for lane, depth in zip(('interactive', 'media', 'report'), scheduler.queue_depth())])
+Collector('scoredb_bot_send_total', 'Bot API send scheduler events',
+          lambda: [({'event': event}, getattr(scheduler, event)) for event in ('sent', 'coalesced', 'retried')],
+          'counter')
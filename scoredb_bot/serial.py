@@ -0,0 +1,143 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from threading import Lock, local
+from time import perf_counter
+from typing import Callable, Deque, Dict, Hashable
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from .env import env
+from .metrics import Collector
+from .tracing import tag, trace
+
+DISPATCHER_WORKERS = env.int('DISPATCHER_WORKERS', 8)
+
+BUSY_MESSAGE = '当前请求过多，请稍后再试'
+
+_local = local()
+
+
+# Runs tasks on a bounded pool while keeping the tasks of each key in order:
+# a key has at most one task running, and its next task goes to the back of
+# the pool's queue when it finishes, so one busy user can't hold on to a
+# worker. Tasks beyond the per-key or total limit are rejected.
+class SerialExecutor:
+    def __init__(self, workers: int, per_key: int, total: int):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='handler')
+        self.per_key = per_key
+        self.total = total
+        self.lock = Lock()
+        # Tasks waiting behind the running one, for every key with a running task.
+        self.queues: Dict[Hashable, Deque[Callable]] = {}
+        # Latest task submitted for each superseding key, by its ID.
+        self.latest: Dict[Hashable, Hashable] = {}
+        self.pending = 0
+        self.shed = 0
+        self.superseded = 0
+
+    def submit(self, key: Hashable, task: Callable, supersede: bool = False, task_id: Hashable = None) -> bool:
+        with self.lock:
+            queue = self.queues.get(key)
+            if supersede:
+                self.latest[key] = task_id
+            if queue is not None and supersede:
+                self.pending -= len(queue)
+                self.superseded += len(queue)
+                queue.clear()
+            if self.pending >= self.total or (queue is not None and len(queue) >= self.per_key):
+                self.shed += 1
+                return False
+            self.pending += 1
+            if queue is None:
+                self.queues[key] = deque()
+                self.executor.submit(self._run, key, task)
+            else:
+                queue.append(task)
+        return True
+
+    def _run(self, key: Hashable, task: Callable):
+        try:
+            task()
+        except Exception as e:
+            logging.error(f'Task of {key} failed: {e!r}')
+        finally:
+            with self.lock:
+                self.pending -= 1
+                queue = self.queues[key]
+                if queue:
+                    self.executor.submit(self._run, key, queue.popleft())
+                else:
+                    del self.queues[key]
+                    self.latest.pop(key, None)
+
+    def is_latest(self, key: Hashable, task_id: Hashable) -> bool:
+        with self.lock:
+            return self.latest.get(key, task_id) == task_id
+
+
+executor = SerialExecutor(workers=DISPATCHER_WORKERS,
+                          per_key=env.int('HANDLER_USER_QUEUE', 5),
+                          total=env.int('HANDLER_QUEUE', 200))
+
+
+def update_key(update: Update) -> Hashable:
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return update.update_id
+
+
+# Whether a newer update has been submitted for the superseding handler
+# running on this thread. It is recorded before the update waits in the
+# queue, so a handler can give up on an update the user has already replaced.
+def is_superseded() -> bool:
+    current = getattr(_local, 'current', None)
+    return current is not None and not executor.is_latest(*current)
+
+
+def reply_busy(update: Update):
+    if update.callback_query:
+        update.callback_query.answer(BUSY_MESSAGE)
+    elif update.effective_message:
+        update.effective_message.reply_text(BUSY_MESSAGE, quote=True)
+
+
+# Wraps a handler callback so the dispatcher thread only queues it. Errors and
+# persistence are handled after it runs, like PTB does for run_async handlers.
+# With `supersede`, a new update drops the user's updates still waiting for
+# the same handler, which suits inline queries typed one key at a time.
+def run_serial(callback: Callable, supersede: bool = False) -> Callable:
+    @wraps(callback)
+    def wrapper(update: Update, context: CallbackContext):
+        dispatcher = context.dispatcher
+        submitted = perf_counter()
+        key = (callback.__name__, update_key(update)) if supersede else update_key(update)
+
+        def task():
+            _local.current = (key, update.update_id) if supersede else None
+            with trace('dispatch', handler=callback.__name__, update_id=update.update_id,
+                       key=update_key(update), queued_ms=round((perf_counter() - submitted) * 1000, 3)):
+                try:
+                    callback(update, context)
+                except Exception as e:
+                    tag(error=type(e).__name__)
+                    dispatcher.dispatch_error(update, e)
+            dispatcher.update_persistence(update)
+
+        if not executor.submit(key, task, supersede, update.update_id):
+            logging.warning(f'Shedding {callback.__name__} for {update_key(update)}, too many queued updates')
+            dispatcher.run_async(reply_busy, update)
+
+    return wrapper
+
+
+Collector('scoredb_bot_handler_queue_depth', 'Updates queued or running on the handler pool',
+          lambda: [({}, executor.pending)])
+Collector('scoredb_bot_handler_dropped_total', 'Updates dropped by the handler pool',
+          lambda: [({'reason': 'shed'}, executor.shed),
+                   ({'reason': 'superseded'}, executor.superseded)], 'counter')
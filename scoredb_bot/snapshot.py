@@ -0,0 +1,114 @@
+import logging
+import mmap
+import os
+import pickle
+from pathlib import Path
+from struct import Struct
+from time import time
+from typing import Optional
+
+from .database import DATA_DIR
+from .env import env
+from .fetcher import live_grants, restore_grants
+from .ttl_cache import budget, caches
+
+SNAPSHOT_ENABLED = env.bool('CACHE_SNAPSHOT', True)
+
+MAGIC = b'SDBSNAP2'
+# Snapshots without grants, whose index is only the entries.
+MAGIC_V1 = b'SDBSNAP1'
+# Magic, then the length of the pickled index and roster grants that follow.
+# The values' pickles come after the index, one after another.
+HEADER = Struct('<8sQ')
+
+
+# A value in the memory-mapped snapshot, only deserialized when it is read.
+class Blob:
+    __slots__ = ('buffer', 'offset', 'length', 'expires')
+
+    def __init__(self, buffer: mmap.mmap, offset: int, length: int, expires: float):
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+        self.expires = expires
+
+    def raw(self) -> bytes:
+        return self.buffer[self.offset:self.offset + self.length]
+
+    def __call__(self):
+        return pickle.loads(self.raw())
+
+
+def snapshot_file(worker: Optional[int] = None) -> Path:
+    return DATA_DIR / (f'cache-{worker}.snapshot' if worker is not None else 'cache.snapshot')
+
+
+def save(filename: Path):
+    now = time()
+    with budget.lock:
+        entries = [(name, key, entry) for name, cache in caches.items() for key, entry in cache.entries.items()]
+        restored = [(name, key, created, blob) for name, cache in caches.items()
+                    for key, (created, blob) in cache.restored.items()]
+    records = []
+    for name, key, entry in entries:
+        expires = entry.created + entry.ttl + entry.stale_ttl
+        if expires <= now:
+            continue
+        try:
+            records.append((name, key, entry.created, expires, pickle.dumps(entry.value, pickle.HIGHEST_PROTOCOL)))
+        except Exception as e:
+            logging.debug(f'Not snapshotting a {name} entry: {e!r}')
+    # Restored entries nobody read are carried over without deserializing them.
+    for name, key, created, blob in restored:
+        if isinstance(blob, Blob) and blob.expires > now:
+            records.append((name, key, created, blob.expires, blob.raw()))
+
+    index = []
+    offset = 0
+    for name, key, created, expires, data in records:
+        index.append((name, key, created, expires, offset, len(data)))
+        offset += len(data)
+    grants = live_grants()
+    index_data = pickle.dumps((index, grants), pickle.HIGHEST_PROTOCOL)
+
+    temp = filename.with_name(filename.name + '.tmp')
+    temp.touch(mode=0o600)
+    with temp.open('wb') as f:
+        f.write(HEADER.pack(MAGIC, len(index_data)))
+        f.write(index_data)
+        for record in records:
+            f.write(record[4])
+    os.replace(temp, filename)
+    logging.info(f'Saved {len(records)} cache entries and {len(grants)} roster grants to "{filename}"')
+
+
+# Only the index is read up front; each value stays in the mapped file until
+# its key is looked up, and keeps its original creation time.
+def restore(filename: Path):
+    if not filename.exists():
+        return
+    try:
+        with filename.open('rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_length = HEADER.unpack_from(buffer)
+        if magic not in (MAGIC, MAGIC_V1):
+            raise ValueError(f'unknown snapshot format {magic!r}')
+        index = pickle.loads(buffer[HEADER.size:HEADER.size + index_length])
+        grants = []
+        if magic == MAGIC:
+            index, grants = index
+    except Exception as e:
+        logging.warning(f'Failed to read cache snapshot "{filename}": {e!r}')
+        return
+    base = HEADER.size + index_length
+    now = time()
+    restored = 0
+    with budget.lock:
+        for name, key, created, expires, offset, length in index:
+            cache = caches.get(name)
+            if cache is None or expires <= now or key in cache.entries:
+                continue
+            cache.restored[key] = (created, Blob(buffer, base + offset, length, expires))
+            restored += 1
+    granted = restore_grants(grants)
+    logging.info(f'Restored {restored} cache entries and {granted} roster grants from "{filename}"')
@@ -0,0 +1,179 @@
+from contextlib import contextmanager
+from threading import Lock, local
+from time import monotonic, sleep
+from typing import Dict, Optional
+
+from requests import RequestException, Response
+
+from .env import env
+from .metrics import Collector
+from .tracing import tag
+from .ttl_cache import LoadSkipped
+
+TOKEN_RATE = env.float('SCOREDB_TOKEN_RATE', 1)
+TOKEN_BURST = env.float('SCOREDB_TOKEN_BURST', 10)
+MAX_WAIT = env.float('SCOREDB_MAX_WAIT', 3)
+# Tokens of the burst background requests leave for the user's own requests.
+BACKGROUND_RESERVE = env.float('SCOREDB_BACKGROUND_RESERVE', TOKEN_BURST / 2)
+# ScoreDB's X-RateLimit-Limit is per this many seconds.
+RATE_WINDOW = env.float('SCOREDB_RATE_WINDOW', 60)
+MIN_RATE = 1 / RATE_WINDOW
+
+THROTTLED_MESSAGE = '查询过于频繁，请稍等片刻再试'
+
+_local = local()
+
+
+class Throttled(RequestException):
+    pass
+
+
+# A background request that didn't get a turn. Users' requests that joined
+# its load in the cache make their own request instead.
+class Deferred(Throttled, LoadSkipped):
+    pass
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenLimit:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until', 'learned')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.blocked_until = 0.0
+        # Whether the rate comes from ScoreDB's headers.
+        self.learned = False
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+# A token bucket per API token. Callers reserve their turn in order, so
+# requests of one token are served first come, first served, and wait for it
+# instead of running into ScoreDB's limit. A caller that would wait longer
+# than its budget fails with Throttled right away.
+#
+# Background requests (prefetches) never wait and only spend tokens above a
+# reserve, so they can't use up the budget of the requests users wait for.
+# Requests of a batch (bulk lookups) get a longer budget, sized to the batch.
+#
+# The rate is learned from ScoreDB's responses: X-RateLimit-* headers set it
+# directly, a 429 blocks the token for Retry-After and, without headers, halves
+# its rate, which then recovers a little with every successful request.
+class UpstreamLimiter:
+    def __init__(self, rate: float, burst: float, max_wait: float, reserve: float):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.reserve = reserve
+        self.lock = Lock()
+        self.limits: Dict[str, TokenLimit] = {}
+        self.waited = 0
+        self.throttled = 0
+        self.deferred = 0
+        self.limited = 0
+
+    def _limit(self, token: str) -> TokenLimit:
+        limit = self.limits.get(token)
+        if limit is None:
+            limit = self.limits[token] = TokenLimit(self.rate, self.burst)
+        return limit
+
+    def token_rate(self, token: str) -> float:
+        with self.lock:
+            return self._limit(token).rate
+
+    def acquire(self, token: str):
+        if self.rate <= 0:
+            return
+        max_wait = getattr(_local, 'max_wait', None) or self.max_wait
+        with self.lock:
+            limit = self._limit(token)
+            now = monotonic()
+            limit.refill(now)
+            if getattr(_local, 'background', False):
+                # The reserve shrinks with a learned capacity, leaving background
+                # requests at least the last token of a full bucket.
+                if limit.blocked_until > now or limit.tokens - 1 < min(self.reserve, limit.capacity - 1):
+                    self.deferred += 1
+                    raise Deferred('Background request would spend the reserved rate limit of the token')
+                limit.tokens -= 1
+                return
+            ready = max(limit.blocked_until, now + max(0.0, (1 - limit.tokens) / limit.rate))
+            delay = ready - now
+            if delay > max_wait:
+                self.throttled += 1
+                raise Throttled(f'Rate limit of the token would be exceeded for {delay:.1f}s')
+            limit.tokens -= 1
+            if delay > 0:
+                self.waited += 1
+        if delay > 0:
+            tag(throttled_ms=round(delay * 1000, 3))
+            sleep(delay)
+
+    def observe(self, token: str, response: Response):
+        if self.rate <= 0:
+            return
+        headers = response.headers
+        allowed = _int(headers.get('X-RateLimit-Limit'))
+        remaining = _int(headers.get('X-RateLimit-Remaining'))
+        with self.lock:
+            limit = self._limit(token)
+            now = monotonic()
+            limit.refill(now)
+            if allowed:
+                limit.rate = allowed / RATE_WINDOW
+                limit.capacity = min(self.burst, allowed)
+                limit.learned = True
+            if remaining is not None:
+                limit.tokens = min(limit.tokens, remaining)
+            if response.status_code == 429:
+                self.limited += 1
+                retry_after = _int(headers.get('Retry-After')) or RATE_WINDOW
+                limit.blocked_until = now + retry_after
+                limit.tokens = min(limit.tokens, 0)
+                if not limit.learned:
+                    limit.rate = max(limit.rate / 2, MIN_RATE)
+            elif not limit.learned and limit.rate < self.rate:
+                limit.rate = min(limit.rate + self.rate / 20, self.rate)
+
+
+limiter = UpstreamLimiter(TOKEN_RATE, TOKEN_BURST, MAX_WAIT, BACKGROUND_RESERVE)
+
+
+# Marks requests made in this block as background requests.
+@contextmanager
+def background():
+    previous = getattr(_local, 'background', False)
+    _local.background = True
+    try:
+        yield
+    finally:
+        _local.background = previous
+
+
+# Lets requests made in this block wait up to `max_wait` seconds for their
+# turn, for a batch of requests expected to queue up behind each other.
+@contextmanager
+def batch(max_wait: float):
+    previous = getattr(_local, 'max_wait', None)
+    _local.max_wait = max_wait
+    try:
+        yield
+    finally:
+        _local.max_wait = previous
+
+
+Collector('scoredb_bot_throttle_total', 'ScoreDB requests delayed or rejected by the per-token limiter',
+          lambda: [({'event': event}, getattr(limiter, event)) for event in ('waited', 'throttled', 'deferred', 'limited')],
+          'counter')
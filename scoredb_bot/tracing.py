@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import random
+from contextlib import contextmanager
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from threading import Lock, local
+from time import perf_counter, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .env import env
+from .metrics import Collector
+
+# Share of updates whose traces are written, from 0 to 1.
+TRACE_SAMPLE_RATE = env.float('TRACE_SAMPLE_RATE', 0)
+# Updates handled slower than this many milliseconds are written even when not
+# sampled. 0 only writes sampled ones.
+TRACE_SLOW_MS = env.float('TRACE_SLOW_MS', 0)
+TRACE_MAX_BYTES = env.int('TRACE_MAX_BYTES', 10 * 1024 * 1024)
+TRACE_BACKUPS = env.int('TRACE_BACKUPS', 3)
+
+TRACING_ENABLED = TRACE_SAMPLE_RATE > 0 or TRACE_SLOW_MS > 0
+
+_local = local()
+_logger = logging.getLogger('scoredb_bot.traces')
+_logger.propagate = False
+_logger.setLevel(logging.INFO)
+
+written = 0
+dropped = 0
+
+
+class Span:
+    __slots__ = ('name', 'start', 'duration', 'depth', 'parent', 'tags')
+
+    def __init__(self, name: str, start: float, depth: int, parent: Optional[int], tags: Dict[str, Any]):
+        self.name = name
+        self.start = start
+        self.duration = 0.0
+        self.depth = depth
+        # Index of the parent span in the trace.
+        self.parent = parent
+        self.tags = tags
+
+    def to_dict(self, origin: float) -> dict:
+        span = {'name': self.name,
+                'start_ms': round((self.start - origin) * 1000, 3),
+                'duration_ms': round(self.duration * 1000, 3),
+                'depth': self.depth}
+        if self.parent is not None:
+            span['parent'] = self.parent
+        if self.tags:
+            span['tags'] = self.tags
+        return span
+
+
+# Spans may be added from several threads, each keeps the spans it has open
+# in its own stack.
+class Trace:
+    __slots__ = ('id', 'started', 'origin', 'sampled', 'tags', 'spans', 'lock')
+
+    def __init__(self, sampled: bool, tags: Dict[str, Any]):
+        self.id = os.urandom(8).hex()
+        self.started = time()
+        self.origin = perf_counter()
+        self.sampled = sampled
+        self.tags = tags
+        self.spans: List[Span] = []
+        self.lock = Lock()
+
+    def add(self, span: Span) -> int:
+        with self.lock:
+            self.spans.append(span)
+            return len(self.spans) - 1
+
+    def to_dict(self) -> dict:
+        root = self.spans[0]
+        with self.lock:
+            spans = [span.to_dict(self.origin) for span in self.spans]
+        return {'trace_id': self.id,
+                'time': self.started,
+                'duration_ms': round(root.duration * 1000, 3),
+                **self.tags,
+                'spans': spans}
+
+
+def current_trace() -> Optional[Trace]:
+    return getattr(_local, 'trace', None)
+
+
+# (index in the trace, span) of the spans open on this thread, innermost last.
+def _stack() -> List[Tuple[int, Span]]:
+    return _local.stack
+
+
+def start_tracing(filename: Path):
+    if not TRACING_ENABLED:
+        return
+    handler = RotatingFileHandler(filename, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS,
+                                  encoding='utf-8', delay=True)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    _logger.addHandler(handler)
+    logging.info(f'Writing traces to {filename}')
+
+
+def _write(trace: Trace):
+    global written, dropped
+    if not trace.sampled and trace.spans[0].duration * 1000 < (TRACE_SLOW_MS or float('inf')):
+        dropped += 1
+        return
+    written += 1
+    _logger.info(json.dumps(trace.to_dict(), ensure_ascii=False, default=str))
+
+
+# Traces the block as the root span of a new trace, unless one is already
+# running on this thread. Spans are recorded for every trace so slow ones can
+# be kept, sampling only decides which of the others are written.
+@contextmanager
+def trace(name: str, **tags):
+    if not TRACING_ENABLED or current_trace() is not None:
+        yield
+        return
+    _local.trace = Trace(random.random() < TRACE_SAMPLE_RATE, tags)
+    _local.stack = []
+    try:
+        with span(name):
+            yield
+    finally:
+        finished = _local.trace
+        _local.trace = _local.stack = None
+        try:
+            _write(finished)
+        except Exception as e:
+            logging.warning(f'Failed to write trace: {e!r}')
+
+
+# Records the block as a span of the thread's current trace, if any.
+@contextmanager
+def span(name: str, **tags):
+    current = current_trace()
+    if current is None:
+        yield
+        return
+    stack = _stack()
+    span_ = Span(name, perf_counter(), len(stack), stack[-1][0] if stack else None, tags)
+    stack.append((current.add(span_), span_))
+    try:
+        yield
+    except BaseException as e:
+        span_.tags['error'] = type(e).__name__
+        raise
+    finally:
+        span_.duration = perf_counter() - span_.start
+        stack.pop()
+
+
+# Tags the innermost open span of the current trace.
+def tag(**tags):
+    if current_trace() is not None and _stack():
+        _stack()[-1][1].tags.update(tags)
+
+
+# Lets `func` add its spans to the current trace, under the span open now,
+# when it is run on another thread, e.g. by an executor.
+def propagate(func: Callable) -> Callable:
+    current = current_trace()
+    if current is None:
+        return func
+    parents = list(_stack())
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = current_trace(), getattr(_local, 'stack', None)
+        _local.trace, _local.stack = current, list(parents)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.trace, _local.stack = previous
+
+    return wrapper
+
+
+def traced(name: str):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+Collector('scoredb_bot_traces_total', 'Finished traces, by whether they were written',
+          lambda: [({'result': 'written'}, written), ({'result': 'dropped'}, dropped)], 'counter')
@@ -0,0 +1,103 @@
+import logging
+from threading import Lock
+from typing import List
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from scoredb import Client
+
+from .env import env
+from .metrics import Collector
+from .throttle import limiter
+
+CONNECT_TIMEOUT = env.float('SCOREDB_CONNECT_TIMEOUT', 5)
+READ_TIMEOUT = env.float('SCOREDB_READ_TIMEOUT', 15)
+
+
+# One adapter, and so one urllib3 pool per host, shared by the sessions of
+# every Client. Each Client keeps its own session for its auth headers.
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, pool_connections: int, pool_maxsize: int, pool_block: bool):
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                         pool_block=pool_block)
+        self.lock = Lock()
+        self.requests = 0
+
+    def send(self, request, timeout=None, **kwargs):
+        with self.lock:
+            self.requests += 1
+        if timeout is None:
+            timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        return super().send(request, timeout=timeout, **kwargs)
+
+    def stats(self) -> List[dict]:
+        pools = self.poolmanager.pools
+        result = []
+        with pools.lock:
+            keys = list(pools.keys())
+        for key in keys:
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections = pool.num_connections
+            requests = pool.num_requests
+            result.append({
+                'host': f'{pool.scheme}://{pool.host}:{pool.port}',
+                'connections_opened': connections,
+                'requests': requests,
+                'idle_connections': pool.pool.qsize() if pool.pool else 0,
+                'reuse_rate': 1 - connections / requests if requests else 0.0,
+            })
+        return result
+
+
+adapter = PooledAdapter(pool_connections=env.int('SCOREDB_POOL_CONNECTIONS', 4),
+                        pool_maxsize=env.int('SCOREDB_POOL_MAXSIZE', 16),
+                        pool_block=env.bool('SCOREDB_POOL_BLOCK', True))
+
+_warned = False
+
+
+def _sessions(obj, depth: int = 2):
+    if isinstance(obj, Session):
+        yield obj
+    elif depth > 0 and hasattr(obj, '__dict__'):
+        for value in vars(obj).values():
+            yield from _sessions(value, depth - 1)
+
+
+def attach(client: Client, token: str) -> Client:
+    global _warned
+    sessions = list(_sessions(client))
+    for session in sessions:
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        session.hooks['response'].append(lambda response, *args, **kwargs: limiter.observe(token, response))
+    if not sessions and not _warned:
+        _warned = True
+        logging.warning('ScoreDB client has no requests session, connection pooling is disabled')
+    return client
+
+
+def create_client(token: str) -> Client:
+    return attach(Client(token), token)
+
+
+def pool_stats() -> dict:
+    return {
+        'requests': adapter.requests,
+        'pools': adapter.stats(),
+    }
+
+
+def _collect_pools(field: str):
+    return lambda: [({'host': pool['host']}, pool[field]) for pool in adapter.stats()]
+
+
+Collector('scoredb_bot_pool_requests_total', 'Requests sent through the ScoreDB connection pool',
+          _collect_pools('requests'), 'counter')
+Collector('scoredb_bot_pool_connections_total', 'Connections opened by the ScoreDB connection pool',
+          _collect_pools('connections_opened'), 'counter')
+Collector('scoredb_bot_pool_idle_connections', 'Idle connections in the ScoreDB connection pool',
+          _collect_pools('idle_connections'))
@@ -0,0 +1,384 @@
+import logging
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from inspect import signature
+from threading import Event, RLock
+from time import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .env import env
+from .metrics import Collector
+from .tracing import span, tag
+
+
+# Values shared between cache entries. Their bytes are charged to the budget
+# once while any entry holds them, instead of to each entry.
+class Shared:
+    __slots__ = ()
+
+    # Bytes used by the value, without the shared values it refers to.
+    def shared_size(self) -> int:
+        return sys.getsizeof(self)
+
+
+# Shared values found along the way are left out of the size and collected in
+# `shared`, with the shared values they refer to.
+def sizeof(obj: Any, seen: Optional[set] = None, shared: Optional[Dict[int, Shared]] = None) -> int:
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, Shared):
+        if shared is not None:
+            shared[id(obj)] = obj
+            for s in obj.__slots__:
+                if hasattr(obj, s):
+                    sizeof(getattr(obj, s), seen, shared)
+        return 0
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k, seen, shared) + sizeof(v, seen, shared) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(i, seen, shared) for i in obj)
+    elif hasattr(obj, '__dict__'):
+        size += sizeof(vars(obj), seen, shared)
+    elif hasattr(obj, '__slots__'):
+        size += sum(sizeof(getattr(obj, s), seen, shared) for s in obj.__slots__ if hasattr(obj, s))
+    return size
+
+
+def is_negative(value: Any) -> bool:
+    return value is None or value == []
+
+
+class Entry:
+    __slots__ = ('value', 'size', 'shared', 'created', 'ttl', 'stale_ttl')
+
+    def __init__(self, value: Any, size: int, shared: Tuple[Shared, ...],
+                 created: float, ttl: float, stale_ttl: float):
+        self.value = value
+        self.size = size
+        # Shared values the entry holds, charged to the budget apart.
+        self.shared = shared
+        self.created = created
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+    def age(self, now: float) -> float:
+        return now - self.created
+
+    def is_fresh(self, now: float) -> bool:
+        return self.age(now) < self.ttl
+
+    def is_usable(self, now: float) -> bool:
+        return self.age(now) < self.ttl + self.stale_ttl
+
+
+# Raised by a loader that gave up for a reason of its own caller, e.g. a
+# background load that won't wait for its turn. Callers that joined the load
+# run it again themselves instead of failing with it.
+class LoadSkipped(Exception):
+    pass
+
+
+class Flight:
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+# A single byte budget shared by every cache, evicting the least recently used
+# entry across all of them.
+class MemoryBudget:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.shared_bytes = 0
+        # id of each shared value held by entries: [value, number of entries
+        # holding it, its size].
+        self.refs: Dict[int, list] = {}
+        # Functions called after entries were evicted.
+        self.on_evict: List[Callable[[], None]] = []
+        self.lock = RLock()
+        self._lru: 'OrderedDict[Tuple[TTLCache, Hashable], None]' = OrderedDict()
+
+    def touch(self, cache: 'TTLCache', key: Hashable):
+        with self.lock:
+            self._lru.move_to_end((cache, key))
+
+    def hold(self, shared: Tuple[Shared, ...]):
+        for value in shared:
+            ref = self.refs.get(id(value))
+            if ref is None:
+                size = value.shared_size()
+                self.refs[id(value)] = [value, 1, size]
+                self.shared_bytes += size
+            else:
+                ref[1] += 1
+
+    def release(self, shared: Tuple[Shared, ...]):
+        for value in shared:
+            ref = self.refs[id(value)]
+            ref[1] -= 1
+            if ref[1] == 0:
+                del self.refs[id(value)]
+                self.shared_bytes -= ref[2]
+
+    def add(self, cache: 'TTLCache', key: Hashable, entry: Entry):
+        with self.lock:
+            self.used_bytes += entry.size
+            self.hold(entry.shared)
+            self._lru[(cache, key)] = None
+            self._lru.move_to_end((cache, key))
+            evicted = False
+            while self.used_bytes + self.shared_bytes > self.max_bytes and len(self._lru) > 1:
+                (victim, victim_key), _ = self._lru.popitem(last=False)
+                victim.discard(victim_key, from_budget=True)
+                victim.evictions += 1
+                evicted = True
+            if evicted:
+                for callback in self.on_evict:
+                    callback()
+
+    def remove(self, cache: 'TTLCache', key: Hashable, entry: Entry):
+        with self.lock:
+            self.used_bytes -= entry.size
+            self.release(entry.shared)
+            self._lru.pop((cache, key), None)
+
+
+budget = MemoryBudget(env.int('CACHE_MEMORY_BUDGET', 64 * 1024 * 1024))
+
+_refresher = ThreadPoolExecutor(max_workers=env.int('CACHE_REFRESH_WORKERS', 4),
+                                thread_name_prefix='cache-refresh')
+
+
+class TTLCache:
+    def __init__(self, name: str, loader: Callable,
+                 ttl: float, negative_ttl: float, stale_ttl: float = 0):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.entries: Dict[Hashable, Entry] = {}
+        self.refreshing = set()
+        self.inflight: Dict[Hashable, Flight] = {}
+        # Entries restored from a snapshot that haven't been read yet: their
+        # creation time and a function deserializing the value.
+        self.restored: Dict[Hashable, Tuple[float, Callable[[], Any]]] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def __hash__(self):
+        return id(self)
+
+    @property
+    def size(self) -> int:
+        with budget.lock:
+            return sum(e.size for e in self.entries.values())
+
+    def _entry(self, key: Hashable) -> Optional[Entry]:
+        entry = self.entries.get(key)
+        if entry is None and key in self.restored:
+            created, load = self.restored.pop(key)
+            try:
+                self.put(key, load(), created)
+            except Exception as e:
+                logging.warning(f'Failed to restore {self.name} entry: {e!r}')
+            entry = self.entries.get(key)
+        return entry
+
+    def lookup(self, key: Hashable) -> Optional[Entry]:
+        now = time()
+        with budget.lock:
+            entry = self._entry(key)
+            if entry is None:
+                return None
+            if not entry.is_usable(now):
+                self.discard(key)
+                return None
+            budget.touch(self, key)
+            return entry
+
+    def contains_fresh(self, key: Hashable) -> bool:
+        with budget.lock:
+            entry = self._entry(key)
+            return entry is not None and entry.is_fresh(time())
+
+    def renew(self, key: Hashable) -> bool:
+        with budget.lock:
+            entry = self._entry(key)
+            if entry is None:
+                return False
+            entry.created = time()
+            return True
+
+    def get(self, key: Hashable) -> Any:
+        entry = self.lookup(key)
+        if entry is not None:
+            if entry.is_fresh(time()):
+                self.hits += 1
+                tag(cache='hit')
+            else:
+                self.stale_hits += 1
+                tag(cache='stale')
+                self.schedule_refresh(key)
+            return entry.value
+        self.misses += 1
+        tag(cache='miss')
+        return self.load(key)
+
+    # Concurrent loads of the same key wait for the first one and share its
+    # result or exception, so only one request per key goes upstream.
+    def load(self, key: Hashable) -> Any:
+        with budget.lock:
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            tag(coalesced=True)
+            flight.event.wait()
+            if isinstance(flight.error, LoadSkipped):
+                return self.load(key)
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = self.loader(*key)
+            self.put(key, flight.value)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with budget.lock:
+                del self.inflight[key]
+            flight.event.set()
+
+    def put(self, key: Hashable, value: Any, created: Optional[float] = None):
+        if is_negative(value):
+            ttl, stale_ttl = self.negative_ttl, 0
+        else:
+            ttl, stale_ttl = self.ttl, self.stale_ttl
+        if ttl <= 0:
+            return
+        shared: Dict[int, Shared] = {}
+        size = sizeof(value, shared=shared) + sizeof(key)
+        held = tuple(shared.values())
+        entry = Entry(value, size + sys.getsizeof(held), held, created or time(), ttl, stale_ttl)
+        with budget.lock:
+            self.discard(key)
+            self.restored.pop(key, None)
+            self.entries[key] = entry
+            budget.add(self, key, entry)
+
+    def discard(self, key: Hashable, from_budget: bool = False):
+        with budget.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and not from_budget:
+                budget.remove(self, key, entry)
+            elif entry is not None:
+                budget.used_bytes -= entry.size
+                budget.release(entry.shared)
+
+    def clear(self):
+        with budget.lock:
+            self.restored.clear()
+            for key in list(self.entries.keys()):
+                self.discard(key)
+
+    def schedule_refresh(self, key: Hashable):
+        with budget.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        _refresher.submit(self._refresh, key)
+
+    def _refresh(self, key: Hashable):
+        try:
+            self.load(key)
+        except Exception as e:
+            logging.warning(f'Background refresh of {self.name} {key[1:]} failed: {e!r}')
+        finally:
+            with budget.lock:
+                self.refreshing.discard(key)
+
+
+caches: Dict[str, TTLCache] = {}
+
+
+def ttl_cache(name: str, ttl: float, negative_ttl: float = 0, stale_ttl: float = 0):
+    def decorator(func):
+        sig = signature(func)
+        cache = TTLCache(name, func, ttl, negative_ttl, stale_ttl)
+        caches[name] = cache
+
+        def make_key(*args, **kwargs) -> tuple:
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return tuple(bound.arguments.values())
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(f'fetch.{name}'):
+                return cache.get(make_key(*args, **kwargs))
+
+        def is_cached(*args, **kwargs) -> bool:
+            return cache.contains_fresh(make_key(*args, **kwargs))
+
+        def peek(*args, **kwargs) -> Any:
+            entry = cache.lookup(make_key(*args, **kwargs))
+            return entry.value if entry is not None else None
+
+        def refresh(*args, **kwargs) -> Any:
+            return cache.load(make_key(*args, **kwargs))
+
+        def renew(*args, **kwargs) -> bool:
+            return cache.renew(make_key(*args, **kwargs))
+
+        wrapper.cache = cache
+        wrapper.is_cached = is_cached
+        wrapper.peek = peek
+        wrapper.refresh = refresh
+        wrapper.renew = renew
+        wrapper.make_key = make_key
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
+def _collect(attribute: str):
+    return lambda: [({'cache': name}, getattr(cache, attribute)) for name, cache in list(caches.items())]
+
+
+Collector('scoredb_bot_cache_hits_total', 'Fresh cache hits', _collect('hits'), 'counter')
+Collector('scoredb_bot_cache_stale_hits_total', 'Stale cache hits served while refreshing',
+          _collect('stale_hits'), 'counter')
+Collector('scoredb_bot_cache_misses_total', 'Cache misses', _collect('misses'), 'counter')
+Collector('scoredb_bot_cache_evictions_total', 'Entries evicted by the memory budget',
+          _collect('evictions'), 'counter')
+Collector('scoredb_bot_cache_coalesced_total', 'Loads that waited on an identical in-flight load',
+          _collect('coalesced'), 'counter')
+Collector('scoredb_bot_cache_bytes', 'Estimated memory used by cache entries', _collect('size'))
+Collector('scoredb_bot_cache_restored_entries', 'Entries restored from a snapshot and not read yet',
+          lambda: [({'cache': name}, len(cache.restored)) for name, cache in list(caches.items())])
+Collector('scoredb_bot_cache_entries', 'Number of cache entries',
+          lambda: [({'cache': name}, len(cache.entries)) for name, cache in list(caches.items())])
+Collector('scoredb_bot_cache_shared_bytes', 'Estimated memory used by values shared between cache entries',
+          lambda: [({}, budget.shared_bytes)])
+Collector('scoredb_bot_cache_budget_bytes', 'Memory budget shared by all caches',
+          lambda: [({}, budget.max_bytes)])
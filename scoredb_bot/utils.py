@@ -6,10 +6,20 @@ from scoredb.models import User
 from telegram import Update
 from telegram.ext import CallbackContext
 
-from .cache import put_oc
+from . import codec
+from .cache import put_oc, get_oc
+
+CALLBACK_DATA_LIMIT = 64
 
 
 def encode_data(event_type: Optional[str], force_oc=False, **kwargs) -> str:
+    if not force_oc:
+        try:
+            compact = codec.encode(event_type, kwargs)
+            if len(compact.encode()) <= CALLBACK_DATA_LIMIT:
+                return compact
+        except codec.CodecError:
+            pass
     kwargs['type'] = event_type
     json_data = json.dumps(kwargs)
     if len(json_data.encode()) > 50 or force_oc:
@@ -18,6 +28,15 @@ def encode_data(event_type: Optional[str], force_oc=False, **kwargs) -> str:
         return json_data
 
 
+def decode_data(raw_data: str, update: Optional[Update] = None) -> Optional[dict]:
+    if raw_data[:3] == 'oc:':
+        return get_oc(raw_data[3:], update)
+    elif codec.is_compact(raw_data):
+        return codec.decode(raw_data)
+    else:
+        return json.loads(raw_data)
+
+
 def gender_emoji(gender: str) -> str:
     if gender == '男':
         return '♂️'
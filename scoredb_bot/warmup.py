@@ -0,0 +1,60 @@
+import logging
+from time import sleep
+from typing import Dict
+
+from requests import RequestException
+from telegram.ext import CallbackContext, JobQueue
+
+from .env import env
+from .fetcher import WARMUP_TOKEN, fetch_class, fetch_grade
+
+WARMUP_GRADES = env.list('WARMUP_GRADES', [])
+WARMUP_INTERVAL = env.int('WARMUP_INTERVAL', 60 * 60)
+WARMUP_RATE = env.float('WARMUP_RATE', 2)
+
+# Student count of each class at its last refresh.
+class_counts: Dict[str, int] = {}
+
+
+def throttle():
+    sleep(1 / WARMUP_RATE)
+
+
+def warm_class(class_id: str, students_count) -> bool:
+    # An unchanged class only has its cached roster renewed.
+    if class_counts.get(class_id) == students_count and fetch_class.renew(WARMUP_TOKEN, class_id):
+        return False
+    class_ = fetch_class.refresh(WARMUP_TOKEN, class_id)
+    if class_ is not None:
+        class_counts[class_id] = class_.studentsCount
+    throttle()
+    return True
+
+
+def warm_up(context: CallbackContext):
+    refreshed = renewed = 0
+    try:
+        for grade_id in WARMUP_GRADES:
+            grade = fetch_grade.refresh(WARMUP_TOKEN, grade_id)
+            throttle()
+            if grade is None:
+                logging.warning(f'Warm-up grade {grade_id} was not found')
+                continue
+            for class_ in grade.classes or []:
+                if warm_class(class_.id, getattr(class_, 'studentsCount', None)):
+                    refreshed += 1
+                else:
+                    renewed += 1
+    except RequestException as e:
+        response = getattr(e, 'response', None)
+        if response is not None and response.status_code == 429:
+            logging.warning('Warm-up is rate limited by ScoreDB, skipping the rest of this run')
+        else:
+            logging.warning(f'Warm-up failed: {e!r}')
+    logging.info(f'Warm-up finished: {refreshed} classes refreshed, {renewed} unchanged')
+
+
+def schedule_warm_up(job_queue: JobQueue):
+    if not WARMUP_TOKEN or not WARMUP_GRADES:
+        return
+    job_queue.run_repeating(warm_up, interval=WARMUP_INTERVAL, first=5, name='warm_up')
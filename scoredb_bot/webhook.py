@@ -0,0 +1,107 @@
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from hmac import compare_digest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from typing import Optional
+
+from telegram import Bot, Update
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Characters Telegram allows in a webhook's secret token.
+SECRET_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,256}')
+# Larger bodies are rejected unread, no update comes close.
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = 30
+    server: 'WebhookServer'
+
+    def _respond(self, status: int):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    # Responds without reading the body, whose bytes are then left on the
+    # connection, which must be closed.
+    def _reject(self, status: int):
+        self.close_connection = True
+        self._respond(status)
+
+    # The request is checked before its body is read, so a client without the
+    # secret can't make the server allocate or wait for a body.
+    def do_POST(self):
+        if self.path != self.server.path:
+            return self._reject(404)
+        if not compare_digest(self.headers.get(SECRET_HEADER, ''), self.server.secret):
+            return self._reject(403)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            return self._reject(400)
+        if length < 0:
+            return self._reject(400)
+        if length > MAX_BODY_BYTES:
+            return self._reject(413)
+        body = self.rfile.read(length)
+        try:
+            update = Update.de_json(json.loads(body), self.server.bot)
+        except (ValueError, KeyError, TypeError):
+            return self._respond(400)
+        if update is None:
+            return self._respond(400)
+        self.server.update_queue.put(update)
+        self._respond(200)
+
+    def do_GET(self):
+        self._respond(404)
+
+    def log_message(self, format, *args):
+        logging.debug(f'Webhook {self.address_string()} {format % args}')
+
+
+# Requests are handled on a fixed pool of threads instead of one thread per
+# connection, so a burst of updates can't spawn unbounded threads.
+#
+# Updates are only accepted on the secret path and with the secret in
+# Telegram's secret token header, anyone else could forge updates from any
+# user otherwise.
+class WebhookServer(HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, listen: str, port: int, secret: str,
+                 bot: Optional[Bot], update_queue, workers: int = 4):
+        if not SECRET_PATTERN.fullmatch(secret or ''):
+            raise ValueError('Webhook mode needs WEBHOOK_SECRET, 1-256 characters of A-Z, a-z, 0-9, _ and -')
+        super().__init__((listen, port), WebhookHandler)
+        self.secret = secret
+        self.path = f'/{secret}'
+        self.bot = bot
+        self.update_queue = update_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webhook')
+        self.thread: Optional[Thread] = None
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def start(self):
+        self.thread = Thread(target=self.serve_forever, name='webhook', daemon=True)
+        self.thread.start()
+        logging.info(f'Webhook listening on {self.server_address[0]}:{self.server_address[1]}')
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.executor.shutdown(wait=False)
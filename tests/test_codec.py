@@ -0,0 +1,112 @@
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+# Importing scoredb_bot opens the SQLite stores and needs a bot token.
+_data_dir = TemporaryDirectory(prefix='scoredb-test-')
+os.environ['DATA_DIR'] = _data_dir.name
+os.environ.setdefault('TELEGRAM_TOKEN', '4242:fake-token-for-tests')
+
+from scoredb_bot import codec  # noqa: E402
+from scoredb_bot.codec import CodecError  # noqa: E402
+from scoredb_bot.utils import CALLBACK_DATA_LIMIT, decode_data, encode_data  # noqa: E402
+
+
+def round_trip(event_type, **kwargs) -> dict:
+    return codec.decode(codec.encode(event_type, kwargs))
+
+
+class RoundTripTest(unittest.TestCase):
+    def test_every_payload_type(self):
+        payloads = {
+            'auth': {},
+            're_auth': {},
+            'class': {'class_id': 'C190101', 'page': 3},
+            'student': {'student_id': '20190101',
+                        'from_page': {'event_type': 'class', 'class_id': 'C190101', 'page': 2}},
+            'search': {'query': '张三', 'page': 12},
+            'photos': {'student_id': '20190101'},
+            'all_photos': {'students': ['20190101', '20190102', 'X0007']},
+            'bulk': {'key': 'a1b2c3d4', 'page': 1},
+            'bulk_csv': {'key': 'a1b2c3d4'},
+        }
+        self.assertEqual(set(payloads), set(codec.SCHEMAS))
+        for event_type, kwargs in payloads.items():
+            with self.subTest(event_type):
+                self.assertEqual(round_trip(event_type, **kwargs), {**kwargs, 'type': event_type})
+
+    def test_missing_fields_are_left_out(self):
+        self.assertEqual(round_trip('class', class_id='C1901', page=None), {'class_id': 'C1901', 'type': 'class'})
+        self.assertEqual(round_trip('student', student_id='20190101'),
+                         {'student_id': '20190101', 'type': 'student'})
+
+    def test_ids(self):
+        for id_ in ('G19', 'g19', 'C190101', '0001', '20190101', '99999999', 'x1'):
+            with self.subTest(id_):
+                self.assertEqual(round_trip('photos', student_id=id_)['student_id'], id_)
+
+    def test_ids_that_cannot_be_packed(self):
+        for id_ in ('123456789', 'AB12', 'S-01', '学生1', ''):
+            with self.subTest(id_):
+                self.assertEqual(round_trip('photos', student_id=id_)['student_id'], id_)
+
+    def test_nested_search_page(self):
+        from_page = {'event_type': 'search', 'query': 'li', 'page': 4}
+        self.assertEqual(round_trip('student', student_id='20190101', from_page=from_page)['from_page'], from_page)
+
+    def test_all_photos_of_a_page_fits_callback_data(self):
+        students = [f'2019{i:04d}' for i in range(1, 10)]
+        data = encode_data('all_photos', students=students)
+        self.assertTrue(codec.is_compact(data))
+        self.assertLessEqual(len(data.encode()), CALLBACK_DATA_LIMIT)
+        self.assertEqual(decode_data(data), {'students': students, 'type': 'all_photos'})
+
+
+class LegacyTest(unittest.TestCase):
+    def test_json_payloads_still_decode(self):
+        payload = {'class_id': 'C190101', 'page': 2, 'type': 'class'}
+        self.assertEqual(decode_data(json.dumps(payload)), payload)
+
+    def test_unknown_event_types_fall_back_to_json(self):
+        data = encode_data('legacy', id='1')
+        self.assertFalse(codec.is_compact(data))
+        self.assertEqual(decode_data(data), {'id': '1', 'type': 'legacy'})
+
+
+class MalformedTest(unittest.TestCase):
+    def test_encode_errors(self):
+        cases = [
+            ('unknown', {}),
+            (None, {}),
+            ('class', {'class_id': 'C1901', 'extra': 1}),
+            ('class', {'class_id': 'C1901', 'page': -1}),
+            ('class', {'class_id': 'C1901', 'page': '2'}),
+            ('student', {'student_id': '1', 'from_page': {'event_type': 'unknown'}}),
+        ]
+        for event_type, kwargs in cases:
+            with self.subTest(event_type=event_type, kwargs=kwargs):
+                with self.assertRaises(CodecError):
+                    codec.encode(event_type, kwargs)
+
+    def test_decode_errors(self):
+        valid = codec.encode('search', {'query': 'abcdef', 'page': 300})
+        cases = [
+            'not compact',
+            codec.PREFIX + '\x00\x01',
+            codec.PREFIX + valid[len(codec.PREFIX):-5],
+            codec.PREFIX + codec.b85encode(bytes([200, 1])).decode(),
+            codec.PREFIX + codec.b85encode(bytes([5, 3, 10, ord('a')])).decode(),
+            codec.PREFIX,
+        ]
+        for raw in cases:
+            with self.subTest(raw=raw):
+                with self.assertRaises(CodecError):
+                    codec.decode(raw)
+
+    def test_codec_error_is_a_value_error(self):
+        self.assertTrue(issubclass(CodecError, ValueError))
+
+
+if __name__ == '__main__':
+    unittest.main()
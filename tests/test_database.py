@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+# Importing scoredb_bot opens the SQLite stores and needs a bot token.
+_data_dir = TemporaryDirectory(prefix='scoredb-test-')
+os.environ['DATA_DIR'] = _data_dir.name
+os.environ.setdefault('TELEGRAM_TOKEN', '4242:fake-token-for-tests')
+
+from scoredb_bot.database import SQLitePersistence  # noqa: E402
+
+
+class FlushTest(unittest.TestCase):
+    def setUp(self):
+        directory = TemporaryDirectory(prefix='scoredb-test-')
+        self.addCleanup(directory.cleanup)
+        self.filename = Path(directory.name) / 'persistence.sqlite3'
+        # Flushed by the tests only.
+        self.persistence = SQLitePersistence(self.filename, flush_interval=3600)
+        self.addCleanup(self.persistence.connection.close)
+        self.addCleanup(self.persistence._stop.set)
+
+    def test_unpicklable_row_is_skipped(self):
+        self.persistence.update_user_data(1, {'token': 'abc'})
+        self.persistence.update_user_data(2, {'callback': lambda: None})
+        with self.assertLogs(level='ERROR'):
+            self.persistence.flush()
+        self.assertEqual(self.persistence.dirty, {})
+        self.assertEqual(self.persistence.get_user_data()[1], {'token': 'abc'})
+        self.assertEqual(self.persistence.get_user_data()[2], {})
+
+    def test_failed_write_keeps_rows(self):
+        self.persistence.update_user_data(1, {'token': 'abc'})
+        self.persistence.update_chat_data(5, {'page': 1})
+        with self.persistence.connection:
+            self.persistence.connection.execute('DROP TABLE user_data')
+        with self.assertRaises(sqlite3.OperationalError):
+            self.persistence.flush()
+        self.assertEqual(set(self.persistence.dirty), {('user_data', 1), ('chat_data', 5)})
+
+        self.persistence.update_user_data(1, {'token': 'def'})
+        with self.persistence.connection:
+            self.persistence.connection.execute('CREATE TABLE user_data (id INTEGER PRIMARY KEY, data BLOB)')
+        self.persistence.flush()
+        self.assertEqual(self.persistence.dirty, {})
+        self.assertEqual(self.persistence.get_user_data()[1], {'token': 'def'})
+        self.assertEqual(self.persistence.get_chat_data()[5], {'page': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import os
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import sleep
+from unittest.mock import patch
+
+# Importing scoredb_bot opens the SQLite stores and needs a bot token.
+_data_dir = TemporaryDirectory(prefix='scoredb-test-')
+os.environ['DATA_DIR'] = _data_dir.name
+os.environ.setdefault('TELEGRAM_TOKEN', '4242:fake-token-for-tests')
+
+from scoredb_bot import ttl_cache  # noqa: E402
+from scoredb_bot.ttl_cache import LoadSkipped, MemoryBudget, Shared, TTLCache  # noqa: E402
+
+
+class Blob(Shared):
+    __slots__ = ('data', 'children')
+
+    def __init__(self, data: bytes, children: tuple = ()):
+        self.data = data
+        self.children = children
+
+    def shared_size(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.data)
+
+
+class BudgetTestCase(unittest.TestCase):
+    max_bytes = 200 * 1024
+
+    def setUp(self):
+        self.budget = MemoryBudget(self.max_bytes)
+        patcher = patch.object(ttl_cache, 'budget', self.budget)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def held_bytes(self) -> int:
+        return sum(size for _, _, size in self.budget.refs.values())
+
+
+class MemoryBudgetTest(BudgetTestCase):
+    def test_shared_values_count_against_the_budget(self):
+        cache = TTLCache('roster', lambda key: tuple(Blob(os.urandom(512)) for _ in range(20)), 60, 0)
+        for key in range(2000):
+            cache.get((key,))
+            self.assertLessEqual(self.budget.used_bytes + self.budget.shared_bytes, self.max_bytes)
+        self.assertGreater(cache.evictions, 0)
+        self.assertEqual(self.budget.shared_bytes, self.held_bytes())
+        self.assertEqual(self.budget.used_bytes, cache.size)
+
+    def test_shared_value_is_charged_once(self):
+        blob = Blob(b'x' * 1000)
+        cache = TTLCache('roster', lambda key: (blob,), 60, 0)
+        cache.get((1,))
+        cache.get((2,))
+        self.assertEqual(self.budget.shared_bytes, blob.shared_size())
+        cache.discard((1,))
+        self.assertEqual(self.budget.shared_bytes, blob.shared_size())
+        cache.discard((2,))
+        self.assertEqual(self.budget.shared_bytes, 0)
+        self.assertEqual(self.budget.refs, {})
+
+    def test_nested_shared_values_are_charged(self):
+        inner = Blob(b'y' * 100)
+        outer = Blob(b'x' * 100, (inner,))
+        cache = TTLCache('grade', lambda key: outer, 60, 0)
+        cache.get((1,))
+        self.assertEqual(self.budget.shared_bytes, inner.shared_size() + outer.shared_size())
+        cache.clear()
+        self.assertEqual(self.budget.shared_bytes, 0)
+
+    def test_eviction_releases_shared_values(self):
+        cache = TTLCache('roster', lambda key: Blob(os.urandom(self.max_bytes // 3)), 60, 0)
+        for key in range(10):
+            cache.get((key,))
+        self.assertLessEqual(len(cache.entries), 2)
+        self.assertEqual(len(self.budget.refs), len(cache.entries))
+        self.assertEqual(self.budget.shared_bytes, self.held_bytes())
+
+    def test_eviction_callbacks(self):
+        calls = []
+        self.budget.on_evict.append(lambda: calls.append(1))
+        cache = TTLCache('roster', lambda key: b'x' * (self.max_bytes // 3), 60, 0)
+        cache.get((1,))
+        self.assertEqual(calls, [])
+        for key in range(2, 6):
+            cache.get((key,))
+        self.assertTrue(calls)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache('roster', lambda key: b'x' * (self.max_bytes // 3), 60, 0)
+        cache.get((1,))
+        cache.get((2,))
+        cache.get((1,))
+        cache.get((3,))
+        self.assertIn((1,), cache.entries)
+        self.assertNotIn((2,), cache.entries)
+
+
+class SingleFlightTest(BudgetTestCase):
+    def run_concurrently(self, cache: TTLCache, count: int) -> tuple:
+        results = [None] * count
+
+        def get(index):
+            try:
+                results[index] = cache.get(('key',))
+            except Exception as e:
+                results[index] = e
+
+        threads = [Thread(target=get, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def wait_for_followers(self, cache: TTLCache, count: int):
+        for _ in range(500):
+            if cache.coalesced >= count:
+                return
+            sleep(0.01)
+        self.fail('followers did not join the load')
+
+    def test_concurrent_misses_load_once(self):
+        calls = []
+        release = Event()
+
+        def loader(key):
+            calls.append(key)
+            release.wait(5)
+            return [key, len(calls)]
+
+        cache = TTLCache('student', loader, 60, 0)
+        threads, results = self.run_concurrently(cache, 5)
+        self.wait_for_followers(cache, 4)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, ['key'])
+        self.assertEqual(results, [['key', 1]] * 5)
+        self.assertEqual(cache.misses, 5)
+        self.assertEqual(cache.get(('key',)), ['key', 1])
+        self.assertEqual(cache.hits, 1)
+
+    def test_followers_share_the_error(self):
+        release = Event()
+
+        def loader(key):
+            release.wait(5)
+            raise RuntimeError('upstream down')
+
+        cache = TTLCache('student', loader, 60, 0)
+        threads, results = self.run_concurrently(cache, 3)
+        self.wait_for_followers(cache, 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(result) for result in results}), 1)
+        self.assertIsInstance(results[0], RuntimeError)
+        self.assertEqual(cache.inflight, {})
+
+    def test_followers_retry_a_skipped_load(self):
+        release = Event()
+        calls = []
+
+        def loader(key):
+            calls.append(key)
+            if len(calls) == 1:
+                release.wait(5)
+                raise LoadSkipped()
+            return 'loaded'
+
+        cache = TTLCache('student', loader, 60, 0)
+        leader = Thread(target=lambda: self.assertRaises(LoadSkipped, cache.load, ('key',)))
+        leader.start()
+        for _ in range(500):
+            if calls:
+                break
+            sleep(0.01)
+        threads, results = self.run_concurrently(cache, 1)
+        self.wait_for_followers(cache, 1)
+        release.set()
+        leader.join()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['loaded'])
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()